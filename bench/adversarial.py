@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import random
+
+# Instances built around the structures that have made the solver blow up, each tagged with the pathology it
+# targets and given at a few sizes with a time budget for bench/run.py. Every builder returns the repository, the
+# initial state and the constraints, and the same size and seed always give the same instance.
+
+
+def package(name, size, depends=(), conflicts=(), version="1"):
+    return {'name': name, 'version': version, 'size': size, 'depends': [list(group) for group in depends],
+            'conflicts': list(conflicts)}
+
+
+def dense_cycles(n, rng):
+    # n packages each depending on every other one, so the whole cone is one strongly connected component
+    names = ["C%d" % i for i in range(n)]
+    repository = [package(name, rng.randint(1, 100), [[other] for other in names if other != name])
+                  for name in names]
+    return repository, [], ["+C0"]
+
+
+def wide_disjunction(n, rng):
+    # A needs one of n alternatives, each with a few versions, and D rules out every alternative but one (which
+    # isn't the lightest)
+    repository = [package("A", 1, [["B%d" % i for i in range(n)], ["D"]])]
+    keep = rng.randrange(n)
+    for i in range(n):
+        for v in range(1, 4):
+            repository.append(package("B%d" % i, rng.randint(1, 1000), version=str(v)))
+    repository.append(package("D", 1, conflicts=["B%d" % i for i in range(n) if i != keep]))
+    return repository, [], ["+A"]
+
+
+def deep_chain(n, rng):
+    # L0 depends on L1 depends on ... L(n - 1), installed only in that order from the bottom up
+    repository = [package("L%d" % i, rng.randint(1, 100), [["L%d" % (i + 1)]] if i + 1 < n else [])
+                  for i in range(n)]
+    return repository, [], ["+L0"]
+
+
+def conflict_clique(n, rng):
+    # n names each in three versions conflicting with every other name, and A needing one of them. The versions of
+    # one name don't conflict, so this isn't the one name at most one group the encoding spots.
+    names = ["Q%d" % i for i in range(n)]
+    repository = [package("A", 1, [names])]
+    for name in names:
+        for v in range(1, 4):
+            repository.append(package(name, rng.randint(1, 1000), conflicts=[other for other in names if other != name],
+                                      version=str(v)))
+    return repository, [], ["+A"]
+
+
+def mass_removal(n, rng):
+    # Like seen-9 scaled up: n packages, half of them installed with each depending on the next, and all of them
+    # forbidden
+    repository = [package("P%d" % i, 10 ** 9, [["P%d" % (i + 1)]] if i + 1 < n // 2 else [], version="0")
+                  for i in range(n)]
+    initial = ["P%d=0" % i for i in range(n // 2)]
+    rng.shuffle(initial)
+    return repository, initial, ["-P%d=0" % i for i in range(n)]
+
+
+pathologies = {
+    'dense-cycles': dense_cycles,
+    'wide-disjunction': wide_disjunction,
+    'deep-chain': deep_chain,
+    'conflict-clique': conflict_clique,
+    'mass-removal': mass_removal,
+}
+
+# (pathology, size, budget in seconds)
+corpus = [
+    ('dense-cycles', 10, 10), ('dense-cycles', 40, 30), ('dense-cycles', 100, 120),
+    ('wide-disjunction', 100, 10), ('wide-disjunction', 1000, 30), ('wide-disjunction', 10000, 120),
+    ('deep-chain', 1000, 10), ('deep-chain', 10000, 30), ('deep-chain', 100000, 120),
+    ('conflict-clique', 10, 10), ('conflict-clique', 50, 30), ('conflict-clique', 200, 120),
+    ('mass-removal', 200, 10), ('mass-removal', 2000, 30), ('mass-removal', 20000, 120),
+]
+
+
+def write(out, pathology, size, seed=0):
+    repository, initial, constraints = pathologies[pathology](size, random.Random(seed))
+    os.makedirs(out, exist_ok=True)
+    for name, value in (('repository.json', repository), ('initial.json', initial),
+                        ('constraints.json', constraints)):
+        with open(os.path.join(out, name), 'w') as f:
+            json.dump(value, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write one adversarial instance')
+    parser.add_argument('out', help='Directory to write repository.json, initial.json and constraints.json to')
+    parser.add_argument('pathology', choices=sorted(pathologies))
+    parser.add_argument('size', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write(args.out, args.pathology, args.size, args.seed)
+
+
+if __name__ == '__main__':
+    main()
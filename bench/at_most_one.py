@@ -0,0 +1,53 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# At most one encodings: names whose versions all conflict with each other, each name required once, solved for the
+# lightest choice with each encoding. Prints the number of constraints, the time to build them and the time to solve.
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from solver.encoding import at_most_one_encodings, at_most_one_constraints
+
+
+def run(encoding, names, versions, seed):
+    from solver.z3 import Bool, Not, Optimize, Or, sat
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    opt = Optimize()
+    constraints = 0
+    for n in range(names):
+        xs = [Bool("x%d_%d" % (n, v)) for v in range(versions)]
+        opt.add(Or(xs))
+        for constraint in at_most_one_constraints(xs, encoding, "amo%d" % n):
+            opt.add(constraint)
+            constraints += 1
+        for x in xs:
+            opt.add_soft(Not(x), rng.randint(1, 1000))
+    built = time.perf_counter()
+    assert opt.check() == sat
+    solved = time.perf_counter()
+    return {'encoding': encoding, 'constraints': constraints, 'build_seconds': round(built - start, 3),
+            'solve_seconds': round(solved - built, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the at most one encodings')
+    parser.add_argument('--names', type=int, default=10)
+    parser.add_argument('--versions', type=int, default=200, help='Versions per name')
+    parser.add_argument('--encoding', action='append', choices=at_most_one_encodings,
+                        help='Encoding to run, may be repeated (default all of them)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for encoding in args.encoding or at_most_one_encodings:
+        print(json.dumps(run(encoding, args.names, args.versions, args.seed)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
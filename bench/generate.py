@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import random
+
+# Seeded synthetic repositories in the tests/ format, for benchmarks at sizes the fixtures don't reach. Names P0, P1,
+# ... each come in the same number of versions. Dependencies mostly point at the next few names (so the dependency
+# graph is layered and cones stay local) and, with probability cycles, back at the few before (which closes cycles
+# through the forward edges). The same arguments always give the same files.
+
+
+def count(rng, mean):
+    # A whole number averaging mean
+    n = int(mean)
+    return n + (1 if rng.random() < mean - n else 0)
+
+
+def version_string(rng, name, versions, ranges):
+    # The bare name, or with probability ranges a comparison against one of its versions
+    if rng.random() >= ranges:
+        return name
+    return "%s%s%d" % (name, rng.choice(['=', '<', '<=', '>', '>=']), rng.randint(1, versions))
+
+
+def generate_packages(packages=1000, versions=5, fanout=1.5, width=2, ranges=0.3, conflicts=0.2, cycles=0.0,
+                      spread=100, seed=0):
+    # Yields packages dicts one at a time so a million of them never have to be held at once
+    rng = random.Random(seed)
+    names = max(1, packages // versions)
+    for i in range(names):
+        for v in range(1, versions + 1):
+            depends = []
+            for _ in range(count(rng, fanout)):
+                group = []
+                for _ in range(rng.randint(1, width)):
+                    if rng.random() < cycles and i > 0:
+                        j = rng.randint(max(0, i - spread), i - 1)
+                    elif i + 1 < names:
+                        j = rng.randint(i + 1, min(names - 1, i + spread))
+                    else:
+                        continue
+                    group.append(version_string(rng, "P%d" % j, versions, ranges))
+                if group:
+                    depends.append(group)
+            conflict_strings = []
+            for _ in range(count(rng, conflicts)):
+                j = rng.randint(max(0, i - spread), min(names - 1, i + spread))
+                if j != i:
+                    conflict_strings.append(version_string(rng, "P%d" % j, versions, ranges))
+            yield {'name': "P%d" % i, 'version': str(v), 'size': rng.randint(1, 1000), 'depends': depends,
+                   'conflicts': conflict_strings}
+
+
+def generate(out, packages=1000, versions=5, fanout=1.5, width=2, ranges=0.3, conflicts=0.2, cycles=0.0, spread=100,
+             installed=0, targets=1, seed=0):
+    # Writes repository.json, initial.json and constraints.json to the directory out. installed names get one of
+    # their versions without depends or conflicts in the initial state, so that it is valid, and targets names near
+    # the top of the graph are asked for.
+    os.makedirs(out, exist_ok=True)
+    leaves = {}
+    with open(os.path.join(out, 'repository.json'), 'w') as f:
+        f.write("[\n")
+        for n, p in enumerate(generate_packages(packages, versions, fanout, width, ranges, conflicts, cycles, spread,
+                                                seed)):
+            f.write((",\n" if n else "") + json.dumps(p))
+            if not p['depends'] and not p['conflicts']:
+                leaves.setdefault(p['name'], []).append(p['version'])
+        f.write("\n]\n")
+
+    # A separate stream, so the state doesn't depend on how many draws the packages took
+    rng = random.Random(seed + 1)
+    names = max(1, packages // versions)
+    leaf_names = list(leaves)
+    state = sorted(rng.sample(range(len(leaf_names)), min(installed, len(leaf_names))))
+    initial = [leaf_names[i] + "=" + rng.choice(leaves[leaf_names[i]]) for i in state]
+    top = max(1, names // 10)
+    constraints = ["+P%d" % i for i in sorted(rng.sample(range(top), min(targets, top)))]
+    with open(os.path.join(out, 'initial.json'), 'w') as f:
+        json.dump(initial, f)
+    with open(os.path.join(out, 'constraints.json'), 'w') as f:
+        json.dump(constraints, f)
+
+
+def add_arguments(parser):
+    parser.add_argument('--packages', type=int, default=1000, help='Number of packages (names times versions)')
+    parser.add_argument('--versions', type=int, default=5, help='Versions of each name')
+    parser.add_argument('--fanout', type=float, default=1.5, help='Mean depends groups per package')
+    parser.add_argument('--width', type=int, default=2, help='Most alternatives in one depends group')
+    parser.add_argument('--ranges', type=float, default=0.3,
+                        help='Share of dependencies and conflicts with a version comparison rather than a bare name')
+    parser.add_argument('--conflicts', type=float, default=0.2, help='Mean conflicts per package')
+    parser.add_argument('--cycles', type=float, default=0.0,
+                        help='Share of dependencies pointing back at an earlier name, closing cycles')
+    parser.add_argument('--spread', type=int, default=100, help='How many names away a dependency or conflict can be')
+    parser.add_argument('--installed', type=int, default=0, help='Names installed in the initial state')
+    parser.add_argument('--targets', type=int, default=1, help='Names asked for in the constraints')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic repository, initial state and constraints')
+    parser.add_argument('out', help='Directory to write repository.json, initial.json and constraints.json to')
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate(args.out, args.packages, args.versions, args.fanout, args.width, args.ranges, args.conflicts, args.cycles,
+             args.spread, args.installed, args.targets, args.seed)
+
+
+if __name__ == '__main__':
+    main()
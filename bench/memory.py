@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+
+# Memory per package: the list of dicts json.load gives against the columnar PackageStore holding the same packages
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from solver.repository import rank_versions
+from solver.store import PackageStore
+
+
+def copies(repository, n):
+    # n renamed copies of a repository, dependencies and conflicts pointing into their own copy
+    names = set(p['name'] for p in repository)
+
+    def rename(version_string, k):
+        for name in names:
+            if version_string.startswith(name) and version_string[len(name):len(name) + 1] in ('', '=', '<', '>'):
+                return name + "_" + str(k) + version_string[len(name):]
+        return version_string
+
+    for k in range(n):
+        for p in repository:
+            q = dict(p, name=p['name'] + "_" + str(k))
+            q['depends'] = [[rename(d, k) for d in dlist] for dlist in p.get('depends', [])]
+            q['conflicts'] = [rename(c, k) for c in p.get('conflicts', [])]
+            yield q
+
+
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory per package of the package store')
+    parser.add_argument('--repo', default=os.path.join(root, 'tests', 'seen-8', 'repository.json'))
+    parser.add_argument('--packages', type=int, default=100000, help='Approximate number of packages to hold')
+    args = parser.parse_args()
+
+    with open(args.repo, 'r') as f:
+        repository = json.load(f)
+    n = max(1, args.packages // len(repository))
+    lines = [json.dumps(p) for p in copies(repository, n)]
+    text = "[" + ",".join(lines) + "]"
+    ranks = rank_versions((pid, p['name'], p['version']) for pid, p in enumerate(json.loads(text), 1))
+
+    packages, dict_bytes = measure(lambda: json.loads(text))
+    del packages
+
+    def build_store():
+        store = PackageStore()
+        for pid, line in enumerate(lines, 1):
+            p = json.loads(line)
+            store.add(pid, p['name'], p['version'], ranks[pid], p['size'], p['depends'], p['conflicts'])
+        return store
+
+    store, store_bytes = measure(build_store)
+    count = len(store)
+    print(json.dumps({
+        'packages': count,
+        'dict_bytes_per_package': round(dict_bytes / count, 1),
+        'store_bytes_per_package': round(store_bytes / count, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import adversarial
+from generate import generate
+
+# Benchmark runner: solves every instance of the chosen suites with the CLI a few times, records wall time, the
+# child's peak RSS and the cost and validity of the plan (from solve validate), and compares them with a baseline.
+# Exits non-zero when an instance fails, regresses past the threshold or goes over its time budget. The first trial
+# of an instance rebuilds the package index for its repository, so it is reported on its own as cold and the others
+# make up the wall time.
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+solve_py = os.path.join(root, 'solver', 'solve.py')
+default_corpus = os.path.join(root, 'bench', 'corpus')
+default_baseline = os.path.join(root, 'bench', 'baseline.json')
+
+# Generated instances of each scale suite, as generate() arguments. Past a few thousand packages the fanout is kept
+# low so the request only reaches a small part of the repository, these measure the size of the repository and
+# not how hard the request is.
+scale_suites = {
+    'scale': [
+        ('scale-1k', dict(packages=1000)),
+        ('scale-10k', dict(packages=10000, fanout=0.5, targets=3)),
+        ('scale-100k', dict(packages=100000, fanout=0.12, targets=3, installed=100)),
+    ],
+    'scale-1m': [
+        ('scale-1m', dict(packages=1000000, fanout=0.12, targets=3, installed=1000)),
+    ],
+}
+suites = ['fixtures'] + list(scale_suites) + ['adversarial']
+
+
+def instance(name, path, suite, budget=None, tags=()):
+    return {'name': name, 'path': path, 'suite': suite, 'budget': budget, 'tags': list(tags)}
+
+
+def fixture_instances():
+    tests = os.path.join(root, 'tests')
+    return [instance(name, os.path.join(tests, name), 'fixtures') for name in sorted(os.listdir(tests))
+            if os.path.exists(os.path.join(tests, name, 'repository.json'))]
+
+
+def generated(corpus, name, spec, build):
+    # Builds the instance into corpus/name with build(path) unless it is already there from the same spec
+    path = os.path.join(corpus, name)
+    spec_path = os.path.join(path, 'spec.json')
+    try:
+        with open(spec_path) as f:
+            if json.load(f) == spec:
+                return path
+    except (OSError, ValueError):
+        pass
+    print("generating %s" % name, file=sys.stderr)
+    build(path)
+    with open(spec_path, 'w') as f:
+        json.dump(spec, f, sort_keys=True)
+    return path
+
+
+def collect(names, corpus):
+    instances = []
+    for suite in names:
+        if suite == 'fixtures':
+            instances.extend(fixture_instances())
+        elif suite == 'adversarial':
+            for pathology, size, budget in adversarial.corpus:
+                name = "%s-%d" % (pathology, size)
+                path = generated(corpus, name, {'pathology': pathology, 'size': size},
+                                 lambda path: adversarial.write(path, pathology, size))
+                instances.append(instance(name, path, suite, budget, [pathology]))
+        else:
+            instances.extend(instance(name, generated(corpus, name, spec, lambda path: generate(path, **spec)), suite)
+                             for name, spec in scale_suites[suite])
+    return instances
+
+
+def run_once(path, timeout):
+    # Wall time, peak RSS in bytes, exit status and output of one CLI run. os.wait4 gives the rusage of this child
+    # alone, where RUSAGE_CHILDREN would be the largest of every child so far.
+    files = [os.path.join(path, f) for f in ('repository.json', 'initial.json', 'constraints.json')]
+    with tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, solve_py] + files, stdout=subprocess.PIPE, stderr=err)
+        timer = threading.Timer(timeout, proc.kill) if timeout else None
+        if timer is not None:
+            timer.start()
+        stdout = proc.stdout.read()
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        timed_out = timer is not None and not timer.is_alive()
+        if timer is not None:
+            timer.cancel()
+        proc.returncode = status
+        proc.stdout.close()
+        err.seek(0)
+        stderr = err.read().decode(errors='replace')
+    rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    if timed_out:
+        return wall, rss, 'timeout', None
+    if status != 0:
+        return wall, rss, 'error', stderr.strip().splitlines()[-1:] or None
+    return wall, rss, 'ok', stdout.decode()
+
+
+def check_plan(path, plan):
+    # What solve validate says about the plan: whether it is valid, its cost and what is wrong with it
+    files = [os.path.join(path, f) for f in ('repository.json', 'initial.json', 'constraints.json')]
+    proc = subprocess.run([sys.executable, solve_py, 'validate'] + files + ['-'], input=plan,
+                          stdout=subprocess.PIPE, universal_newlines=True)
+    return json.loads(proc.stdout)
+
+
+def bench(inst, trials, timeout):
+    walls = []
+    rss = 0
+    output = None
+    for _ in range(trials):
+        wall, peak, status, output = run_once(inst['path'], timeout)
+        walls.append(wall)
+        rss = max(rss, peak)
+        if status != 'ok':
+            return {'status': status, 'cold': walls[0], 'wall': wall, 'max_rss': rss, 'error': output}
+    result = {'status': 'ok', 'cold': walls[0], 'wall': statistics.median(walls[1:] or walls), 'walls': walls,
+              'max_rss': rss}
+    if output.strip() == "no solution":
+        result['cost'] = None
+    else:
+        result['commands'] = len(json.loads(output))
+        check = check_plan(inst['path'], output)
+        result['cost'] = check['cost']
+        result['valid'] = check['valid']
+        if not check['valid']:
+            result['error'] = check['error']
+    return result
+
+
+def compare(name, result, base, threshold, min_seconds):
+    # Reasons result is worse than base: no plan where base had one or a dearer one, or slower or bigger by more than
+    # threshold (and slower by more than min_seconds, below which it's noise). Invalid plans fail without a baseline.
+    if base is None or base['status'] != 'ok':
+        return []
+    reasons = []
+    if base['cost'] is not None and (result['cost'] is None or result['cost'] > base['cost']):
+        reasons.append("%s: cost %s, was %s" % (name, result['cost'], base['cost']))
+    if result['wall'] > base['wall'] * (1 + threshold) and result['wall'] - base['wall'] > min_seconds:
+        reasons.append("%s: wall %.3fs, was %.3fs" % (name, result['wall'], base['wall']))
+    if result['max_rss'] > base['max_rss'] * (1 + threshold):
+        reasons.append("%s: max RSS %d MB, was %d MB" % (name, result['max_rss'] >> 20, base['max_rss'] >> 20))
+    return reasons
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the solver over the test fixtures and generated corpora')
+    parser.add_argument('--suite', action='append', choices=suites,
+                        help='Suite to run, may be repeated (default fixtures and scale)')
+    parser.add_argument('--match', metavar='TEXT', help='Only run instances with TEXT in their name')
+    parser.add_argument('--tag', action='append', choices=sorted(adversarial.pathologies),
+                        help='Only run instances tagged with this pathology, may be repeated')
+    parser.add_argument('--trials', type=int, default=3, help='Runs of each instance')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds before a run is killed')
+    parser.add_argument('--corpus', default=default_corpus, help='Where generated instances are kept')
+    parser.add_argument('--baseline', default=default_baseline, help='Baseline to compare with, if it exists')
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Slowdown or growth in RSS past which an instance counts as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.1, help='Slowdowns smaller than this are ignored')
+    parser.add_argument('--out', metavar='PATH', help='Write the results as JSON')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    failures = []
+    for inst in collect(args.suite or ['fixtures', 'scale'], args.corpus):
+        name = inst['name']
+        if args.match and args.match not in name or args.tag and not set(args.tag).intersection(inst['tags']):
+            continue
+        result = bench(inst, args.trials, args.timeout)
+        results[name] = result
+        print("%-24s %-8s cold %8.3fs  wall %8.3fs  rss %6d MB  cost %s%s" % (
+            name, result['status'], result['cold'], result['wall'], result['max_rss'] >> 20, result.get('cost'),
+            "  (invalid: %s)" % result['error'] if result.get('valid') is False else ""))
+        if result['status'] != 'ok':
+            failures.append("%s: %s %s" % (name, result['status'], result.get('error') or ''))
+        elif result.get('valid') is False:
+            failures.append("%s: invalid plan, %s" % (name, result['error']))
+        elif inst['budget'] is not None and result['wall'] > inst['budget']:
+            failures.append("%s: wall %.3fs, over its %ss budget" % (name, result['wall'], inst['budget']))
+        else:
+            failures.extend(compare(name, result, baseline.get(name), args.threshold, args.min_seconds))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    for failure in failures:
+        print("FAIL: " + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
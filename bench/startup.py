@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Startup benchmark: runs the CLI on a request it can answer without the package index under python -X importtime
+# and reports wall time, total import time and the slowest imports. Fails if anything heavy got imported.
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+solve_py = os.path.join(root, 'solver', 'solve.py')
+heavy = ['z3', 'networkx', 'pymysql', 'packaging']
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nested imports are indented by two spaces per level under the module that imported them
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def run(repo, initial, constraints):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', solve_py, repo, initial, constraints],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    return time.perf_counter() - start, proc.stdout, parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CLI startup on a trivial request')
+    parser.add_argument('--repo', default=os.path.join(root, 'tests', 'example-0', 'repository.json'))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, help='Fail if the best wall time is above this')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        empty = os.path.join(tmp, 'empty.json')
+        with open(empty, 'w') as f:
+            json.dump([], f)
+        results = [run(args.repo, empty, empty) for _ in range(args.runs)]
+
+    best, stdout, imports = min(results, key=lambda r: r[0])
+    top_level = [i for i in imports if i[1] == 0]
+    total_ms = sum(i[3] for i in top_level) / 1000.0
+    print("wall: best %.1f ms over %d runs" % (best * 1000, args.runs))
+    print("imports: %d modules, %.1f ms" % (len(imports), total_ms))
+    for name, _, _, cumulative in sorted(top_level, key=lambda i: -i[3])[:args.top]:
+        print("  %8.1f ms  %s" % (cumulative / 1000.0, name))
+
+    failed = False
+    # Every component of every dotted name, so the bundled z3 counts as solver.z3
+    loaded = set(part for i in imports for part in i[0].split('.'))
+    for module in heavy:
+        if module in loaded:
+            print("FAIL: %s imported for a trivial request" % module)
+            failed = True
+    if stdout.strip() != '[]':
+        print("FAIL: unexpected output %r" % stdout)
+        failed = True
+    if args.max_ms is not None and best * 1000 > args.max_ms:
+        print("FAIL: %.1f ms is over the %.1f ms budget" % (best * 1000, args.max_ms))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,12 @@
 #!/bin/bash
+# Solves every fixture and checks each plan with solve validate, exiting 1 if any plan is invalid
+status=0
 for f in $(ls -d tests/*); do
   echo "Running $f"
-  ./solve $f/repository.json $f/initial.json $f/constraints.json
+  plan=$(./solve $f/repository.json $f/initial.json $f/constraints.json)
+  echo "$plan"
+  if [ "$plan" != "no solution" ]; then
+    echo "$plan" | ./solve validate $f/repository.json $f/initial.json $f/constraints.json - || status=1
+  fi
 done
+exit $status
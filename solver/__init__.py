@@ -0,0 +1,24 @@
+# The solver and its database driver take a while to import, and every module in here (solve.py included) imports the
+# package first, so the names below are only loaded when they are used
+exports = {
+    'Repository': ('repository', 'Repository'),
+    'DependencySolver': ('dependency_solver', 'DependencySolver'),
+    'Solver': ('dependency_solver', 'DependencySolver'),
+    'SolveOptions': ('dependency_solver', 'SolveOptions'),
+    'Plan': ('dependency_solver', 'Plan'),
+    'validate_plan': ('validate', 'validate_plan'),
+}
+
+
+def __getattr__(name):
+    if name not in exports:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    from importlib import import_module
+    module, attribute = exports[name]
+    value = getattr(import_module('.' + module, __name__), attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(exports))
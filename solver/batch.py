@@ -0,0 +1,96 @@
+import json
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+from .dependency_solver import DependencySolver, SolveOptions
+from .fastpath import fast_paths
+from .profiling import profiled
+from .reader import load_json
+from .repository import Repository, make_conn
+
+worker_solver = None
+worker_options = None
+
+
+def read_requests(path):
+    # One request per line: {"id": ..., "initial": [...], "constraints": [...], "lock": ...}
+    # initial and constraints can also be paths to the usual json files. "profile" ("cprofile" or "sample") profiles
+    # that request alone, into "profile_out" (default profile-<id>.pstats or .folded) at "profile_hz" for sampling.
+    with open(path, 'r') as f:
+        for n, line in enumerate(f):
+            if line.strip():
+                yield n, json.loads(line)
+
+
+def request_field(request, key):
+    value = request.get(key, [])
+    return load_json(value) if isinstance(value, str) else value
+
+
+def request_options(options, request):
+    # The batch's options with the request's own lockfile
+    if options is None:
+        options = SolveOptions()
+    return SolveOptions(lock=request.get('lock'), order_bys=options.order_bys, at_most_one=options.at_most_one,
+                        solver_log=options.solver_log, timeout=options.timeout)
+
+
+def run_request(solver, n, request, options=None):
+    start = time.perf_counter()
+    result = {'id': request.get('id', n)}
+    mode = request.get('profile')
+    profile_out = request.get('profile_out')
+    if mode and not profile_out:
+        profile_out = "profile-%s.%s" % (result['id'], 'pstats' if mode == 'cprofile' else 'folded')
+    try:
+        with profiled(mode, profile_out, request.get('profile_hz', 100)):
+            plan = solver.solve(request_field(request, 'initial'), request_field(request, 'constraints'),
+                                request_options(options, request))
+        result['plan'] = plan.commands if plan.solved else "no solution"
+        result['cost'] = plan.cost
+        result['strategy'] = plan.strategy
+    except Exception as e:
+        result['error'] = repr(e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def init_worker(database, snapshot, options):
+    # Each worker gets its own connection to the index the parent already brought up to date
+    global worker_solver, worker_options
+    worker_solver = DependencySolver(Repository(make_conn(database), snapshot, database))
+    worker_options = options
+
+
+def run_in_worker(request):
+    return run_request(worker_solver, *request, options=worker_options)
+
+
+def run_batch(repo, path, jobs=1, out=sys.stdout, options=None):
+    # options apply to every request (except lock, which comes from each request)
+    requests = read_requests(path)
+    if jobs > 1:
+        pool = Pool(jobs, init_worker, (repo.database, repo.snapshot, options))
+        # imap hands results back in input order as soon as the next one is ready
+        results = pool.imap(run_in_worker, requests)
+    else:
+        pool = None
+        solver = DependencySolver(repo)
+        results = (run_request(solver, n, request, options) for n, request in requests)
+
+    total = 0
+    hits = Counter()
+    for result in results:
+        print(json.dumps(result), file=out, flush=True)
+        total += 1
+        if result.get('strategy') in fast_paths:
+            hits[result['strategy']] += 1
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    print("fast paths: %d of %d requests (%s)" % (sum(hits.values()), total,
+                                                  ", ".join("%s %d" % (k, hits[k]) for k in fast_paths)),
+          file=sys.stderr)
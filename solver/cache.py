@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+from .reader import file_hash
+
+cache_schema = \
+    """
+    CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY,
+        output TEXT,
+        last_used INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used);
+    CREATE TABLE IF NOT EXISTS file_hashes (
+        path TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime INTEGER,
+        hash TEXT
+    );
+    CREATE TABLE IF NOT EXISTS stats (
+        k TEXT PRIMARY KEY,
+        v INTEGER
+    );
+    INSERT OR IGNORE INTO stats(k, v) VALUES ('hits', 0), ('misses', 0), ('clock', 0);
+    """
+
+
+def request_key(snapshot, initial, constraints, pipeline='full'):
+    # The order of the initial state and of the constraints doesn't change the answer, the pipeline solved with can
+    canonical = json.dumps([snapshot, pipeline, sorted(initial), sorted(set(c.strip() for c in constraints))])
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path, max_entries=10000):
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path)
+        self.db.executescript(cache_schema)
+
+    def file_hash(self, path):
+        # Hashing a big repository on every run would cost more than a hit saves, so remember it by size and mtime
+        st = os.stat(path)
+        path = os.path.abspath(path)
+        res = self.db.execute("SELECT hash FROM file_hashes WHERE path = ? AND size = ? AND mtime = ?",
+                              [path, st.st_size, st.st_mtime_ns]).fetchone()
+        if res is not None:
+            return res[0]
+        h = file_hash(path)
+        self.db.execute("REPLACE INTO file_hashes(path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                        [path, st.st_size, st.st_mtime_ns, h])
+        self.db.commit()
+        return h
+
+    def tick(self):
+        self.db.execute("UPDATE stats SET v = v + 1 WHERE k = 'clock'")
+        return self.db.execute("SELECT v FROM stats WHERE k = 'clock'").fetchone()[0]
+
+    def get(self, key):
+        res = self.db.execute("SELECT output FROM results WHERE key = ?", [key]).fetchone()
+        if res is None:
+            self.db.execute("UPDATE stats SET v = v + 1 WHERE k = 'misses'")
+            self.db.commit()
+            return None
+        self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", [self.tick(), key])
+        self.db.execute("UPDATE stats SET v = v + 1 WHERE k = 'hits'")
+        self.db.commit()
+        return res[0]
+
+    def put(self, key, output):
+        self.db.execute("REPLACE INTO results(key, output, last_used) VALUES (?, ?, ?)", [key, output, self.tick()])
+        # Evict least recently used entries past the bound
+        self.db.execute("DELETE FROM results WHERE key IN "
+                        "(SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)", [self.max_entries])
+        self.db.commit()
+
+    def stats(self):
+        stats = dict(self.db.execute("SELECT k, v FROM stats").fetchall())
+        total = stats['hits'] + stats['misses']
+        return stats['hits'], stats['misses'], stats['hits'] / total if total else 0.0
+
+    def report(self, hit):
+        hits, misses, ratio = self.stats()
+        print("cache %s (hits %d, misses %d, hit ratio %.2f)" % ("hit" if hit else "miss", hits, misses, ratio),
+              file=sys.stderr)
@@ -0,0 +1,59 @@
+from .matching import compile_vstring
+
+
+def ordered(rows, order_by):
+    # The rows "SELECT ... ORDER BY <order_by>" would return
+    tokens = order_by.split()
+    rows = sorted(rows, key=lambda r: r[tokens[0]], reverse=tokens[1] == "DESC")
+    if "LIMIT" in tokens:
+        offset = int(tokens[3].split(",")[0])
+        return rows[offset:offset + 1]
+    return rows
+
+
+def pick(rows, order_by):
+    # The first row under the ordering, falling back to the lightest when a "LIMIT k,1" ordering runs past the end
+    if not rows:
+        return None
+    return (ordered(rows, order_by) or ordered(rows, 'weight ASC'))[0]
+
+
+class Constraint:
+    def __init__(self, text):
+        self.text = text
+        self.install = text[0] == "+"
+        self.matcher = compile_vstring(text[1:])
+        self.name = self.matcher.name
+        self.candidates = []
+
+    def resolve(self, packages):
+        # packages are the repository rows for this name
+        self.candidates = [p for p in packages if self.matcher.matches(p['version'])]
+
+
+class CompiledConstraints:
+    # Constraints parsed and resolved against the repository once per solve. A - constraint forbids every version it
+    # matches, a + constraint installs one of its candidates, which one depending on the strategy's ordering.
+
+    def __init__(self, repo, constraints):
+        self.constraints = [Constraint(text) for text in constraints]
+        packages = repo.find_packages(set(c.name for c in self.constraints))
+        for c in self.constraints:
+            c.resolve(packages.get(c.name, []))
+        self.forbidden = frozenset(p['id'] for c in self.constraints if not c.install for p in c.candidates)
+        self.installs = []
+        self.required = frozenset()
+
+    @property
+    def satisfiable(self):
+        return all(c.candidates for c in self.constraints if c.install)
+
+    def choose(self, order_by):
+        self.installs = [pick(c.candidates, order_by)['id'] for c in self.constraints if c.install]
+        self.required = frozenset(self.installs)
+
+    def is_required(self, pid):
+        return pid in self.required
+
+    def is_forbidden(self, pid):
+        return pid in self.forbidden
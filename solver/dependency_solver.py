@@ -0,0 +1,544 @@
+import json
+import time
+
+import pymysql
+
+from .constraints import CompiledConstraints, ordered
+from .encoding import DependencyCone, at_most_one_constraints, true_ids
+from .fastpath import classify
+from .graph import Graph
+from .lockfile import read_lock, write_lock, check_lock
+from .matching import compile_vstring
+from .metrics import append_solver_log, solver_statistics
+
+# The per strategy table is temporary so every connection gets its own, which lets solves run side by side
+depends_db = \
+    """
+    CREATE TEMPORARY TABLE depends (
+        package_id INTEGER,
+        depend_package_id INTEGER,
+        must_be_installed INTEGER,
+        opt_dep_group INTEGER,
+        PRIMARY KEY (package_id, depend_package_id)
+    );
+    """
+
+del_everything_except_pkg = "DROP TEMPORARY TABLE IF EXISTS depends"
+
+order_bys = ['weight ASC', 'weight DESC', 'version_rank ASC', 'version_rank DESC', 'id DESC', 'weight ASC LIMIT 1,1',
+             'weight ASC LIMIT 2,1', 'weight ASC LIMIT 3,1', 'weight ASC LIMIT 4,1']
+
+
+# Cost of taking a package out of the initial state
+uninstall_cost = 10 ** 6
+# Solutions thrown out for having no order that keeps every state on the way valid before the full solve gives up
+unordered_retries = 10
+
+
+def plan_cost(store, steps):
+    # Sizes installed plus uninstall_cost per package taken out, for steps with uninstalls negated
+    return sum(uninstall_cost if pid < 0 else store.weights[store.row(pid)] for pid in steps)
+
+
+class SolveOptions:
+    def __init__(self, lock=None, order_bys=None, at_most_one='atmost', solver_log=None, timeout=120):
+        # lock: lockfile to check before solving and to write the solved state to
+        # order_bys: None for one optimising solve over every candidate of every dependency, or a list of orderings
+        # (e.g. dependency_solver.order_bys) for the older pipeline that follows one candidate per dependency under
+        # each ordering and keeps the cheapest plan
+        # at_most_one: how versions of a name that all conflict with each other are encoded, one of
+        # encoding.at_most_one_encodings
+        # solver_log: file a line of z3 statistics is appended to for each solve that gets as far as z3
+        # timeout: seconds each z3 check may take before the solve gives up with no solution, None or 0 for no limit
+        self.lock = lock
+        self.order_bys = order_bys
+        self.at_most_one = at_most_one
+        self.solver_log = solver_log
+        self.timeout = timeout
+
+
+class Plan:
+    def __init__(self, commands, cost=0, strategy=None, steps=None, store=None):
+        # commands is None when there is no solution. Solves give steps instead, package ids negated for uninstalls,
+        # which are only turned into commands from the store when they are asked for, so plans that lose never are.
+        self._commands = commands
+        self.steps = steps
+        self.store = store
+        self.cost = cost
+        self.strategy = strategy
+
+    @property
+    def commands(self):
+        if self._commands is None and self.steps is not None:
+            views = [self.store.view(abs(step)) for step in self.steps]
+            self._commands = [("+" if step > 0 else "-") + p.name + "=" + p.version for step, p in zip(self.steps, views)]
+        return self._commands
+
+    @property
+    def solved(self):
+        return self._commands is not None or self.steps is not None
+
+    def to_json(self):
+        return json.dumps(self.commands) if self.solved else "no solution"
+
+
+class DependencySolver:
+    def __init__(self, repo, metrics=None):
+        self.repo = repo
+        self.metrics = metrics if metrics is not None else repo.metrics
+        self.conn = repo.conn
+        self.c = repo.c
+        self.opt_dep_group = 0
+        # Size, time and z3 statistics of every check run by the last solve
+        self.checks = []
+        self.timeout = None
+
+    def solve(self, initial, constraints, options=None):
+        if options is None:
+            options = SolveOptions()
+
+        self.checks = []
+        self.timeout = options.timeout
+        plan = self.find_plan(initial, constraints, options)
+        self.metrics.set('strategy', plan.strategy)
+        self.metrics.set('cost', plan.cost)
+        self.metrics.add_checks(self.checks)
+        if options.solver_log and self.checks:
+            append_solver_log(options.solver_log, {'time': time.time(), 'initial': len(initial),
+                                                   'constraints': len(constraints), 'strategy': plan.strategy,
+                                                   'cost': plan.cost, 'checks': self.checks})
+        if plan.solved:
+            # Only the winning plan is ever rendered
+            with self.metrics.phase('render'):
+                self.metrics.set('commands', len(plan.commands))
+        return plan
+
+    def find_plan(self, initial, constraints, options):
+        metrics = self.metrics
+        if len(constraints) == 0:
+            return Plan([])
+
+        with metrics.phase('fast_path'):
+            fast_path, commands, cost = classify(self.repo, initial, constraints)
+        if fast_path is not None:
+            plan = Plan(commands, cost, fast_path)
+            # Only the leaf path gives steps to check, the others answer with none or with no solution
+            if fast_path != 'leaf' or self.valid(plan, initial, constraints):
+                metrics.count('fast_path_' + fast_path)
+                return plan
+
+        if options.lock and all("=" in i for i in initial):
+            # Yesterday's state may well still be valid, which only needs its own members checking
+            with metrics.phase('lock'):
+                locked = read_lock(options.lock)
+                valid = False
+                if locked is not None:
+                    packages = self.repo.lock_packages(locked)
+                    valid = check_lock(locked, packages, constraints)
+            if valid:
+                plan = self.run_lock(initial, locked)
+                if plan.solved and self.valid(plan, initial, constraints):
+                    return plan
+
+        with metrics.phase('constraints'):
+            compiled = CompiledConstraints(self.repo, constraints)
+        if not compiled.satisfiable:
+            return Plan(None)
+
+        if options.order_bys is None:
+            best = self.run_full(initial, compiled, options.at_most_one)
+            if not best.solved:
+                return best
+        else:
+            plans = []
+            for order in options.order_bys:
+                plan = self.run_strategy(initial, compiled, order)
+                if not plan.solved:
+                    return plan
+                plans.append(plan)
+            best = min(plans, key=lambda p: p.cost)
+
+        if options.lock:
+            with metrics.phase('render'):
+                # Bare names in the initial state are written as the version the solve took them to be, since a
+                # lock is only read back when every entry has a version
+                order_by = best.strategy if options.order_bys is not None else 'weight ASC'
+                views = [self.repo.store.view(pid) for pid in self.initial_ids(initial, order_by)]
+                write_lock(options.lock, [view.name + "=" + view.version for view in views], best.commands)
+        return best
+
+    def valid(self, plan, initial, constraints):
+        # Fast path and lock plans come from checks that only look at part of the state, so they are replayed with
+        # the validator before being returned, falling back to a solve if it finds anything wrong
+        from .validate import validate_plan
+
+        with self.metrics.phase('validate'):
+            error, _ = validate_plan(self.repo, initial, constraints, plan.commands)
+        return error is None
+
+    def initial_ids(self, initial, order_by='weight ASC'):
+        # Package ids of the initial state, a bare name standing for its first version under the ordering
+        ids = []
+        for i in initial:
+            if "=" in i:
+                name, version = i.split("=")
+                ids.extend(p.id for p in self.repo.packages_named(name) if p.version == version)
+            else:
+                rows = ordered(self.repo.packages_named(i), order_by)
+                if rows:
+                    ids.append(rows[0].id)
+        return ids
+
+    def run_lock(self, initial, locked):
+        # The steps from the initial state to the locked one, scheduled the same way as a full solve's so that every
+        # state on the way is valid, or no plan when there is no such order
+        store = self.repo.store
+        with self.metrics.phase('lock'):
+            state = self.initial_ids(initial)
+            chosen = self.initial_ids(locked)
+            cone = DependencyCone(self.repo, state + chosen)
+            steps = cone.plan_order(set(chosen), set(state))
+        if steps is None:
+            return Plan(None, strategy='lock')
+        return Plan(None, plan_cost(store, steps), 'lock', steps, store)
+
+    def run_full(self, initial, compiled, at_most_one='atmost'):
+        # One optimising solve over every candidate of every dependency instead of one pass per ordering
+        from .z3 import Not, Or, sat, unknown
+
+        metrics = self.metrics
+        store = self.repo.store
+        with metrics.phase('cone', 'full'):
+            state = self.initial_ids(initial)
+            state_ids = set(state)
+            cone = DependencyCone(self.repo, [p['id'] for c in compiled.constraints if c.install
+                                              for p in c.candidates] + state)
+        metrics.count('cone_packages', len(cone), 'full')
+        with metrics.phase('cycles', 'full'):
+            component = cone.components()
+        metrics.count('cycle_packages', len(component), 'full')
+
+        opt, x, size = self.encode_full(cone, compiled, state_ids, component, at_most_one)
+        # Unsat when no order installs the cycles one package at a time, which is no solution
+        for _ in range(unordered_retries + 1):
+            result = self.check(opt, 'full', *size)
+            if result == unknown:
+                return Plan(None, strategy='timeout')
+            if result != sat:
+                break
+            with metrics.phase('model', 'full'):
+                chosen = true_ids(opt.model()).intersection(x)
+            with metrics.phase('order', 'full'):
+                steps = cone.plan_order(chosen, state_ids)
+            if steps is not None:
+                return Plan(None, plan_cost(store, steps), 'full', steps, store)
+            # The initial state can't be changed into this one a package at a time (say a kept package relies on one
+            # being removed until a replacement that conflicts with it is in), so rule it out and take the next best
+            opt.add(Or([Not(x[pid]) for pid in chosen] + [x[pid] for pid in cone.ids if pid not in chosen]))
+        return Plan(None, strategy='full')
+
+    def encode_full(self, cone, compiled, state_ids, component, at_most_one='atmost'):
+        # A package implies one candidate out of each of its depends groups and none of its conflicts. The cost is
+        # minimised first (sizes installed, uninstall_cost per package taken out of the initial state), then the
+        # number of packages installed, which keeps size 0 packages out. Packages in component (dependency cycles)
+        # get an install position and can only rely on members of their cycle installed before them. Names whose
+        # versions all conflict with each other become one at most one group instead of k(k - 1) / 2 conflicts.
+        with self.metrics.phase('encoding', 'full'):
+            opt, x, soft, variables = self.build_full(cone, compiled, state_ids, component, at_most_one)
+        constraints = len(opt.assertions())
+        self.metrics.count('variables', variables, 'full')
+        self.metrics.count('constraints', constraints, 'full')
+        self.metrics.count('soft_constraints', soft, 'full')
+        return opt, x, (variables, constraints)
+
+    def check(self, solver, strategy, variables, constraints):
+        # Runs z3 and keeps its statistics along with the size of the instance it was given. Past the timeout z3
+        # stops and answers unknown.
+        if self.timeout:
+            solver.set('timeout', int(self.timeout * 1000))
+        with self.metrics.phase('check', strategy):
+            start = time.perf_counter()
+            result = solver.check()
+            seconds = time.perf_counter() - start
+        self.checks.append({'strategy': strategy, 'result': str(result), 'seconds': seconds, 'variables': variables,
+                            'constraints': constraints, 'z3': solver_statistics(solver)})
+        return result
+
+    def build_full(self, cone, compiled, state_ids, component, at_most_one):
+        from .z3 import Optimize, Bool, Int, Not, Or, And, Implies
+
+        store = self.repo.store
+        soft = 0
+        x = dict((pid, Bool(pid)) for pid in cone.ids)
+        position = dict((pid, Int("position%d" % pid)) for pid in component if pid not in state_ids)
+
+        def supports(pid, cid):
+            if cid == pid or pid not in position or cid not in position or component[cid] != component[pid]:
+                return x[cid]
+            return And(x[cid], position[cid] < position[pid])
+
+        opt = Optimize()
+        exclusive = {}
+        if at_most_one != 'pairwise':
+            for n, pids in enumerate(cone.exclusive_groups()):
+                for pid in pids:
+                    exclusive[pid] = n
+                for constraint in at_most_one_constraints([x[pid] for pid in pids], at_most_one, "amo%d" % n):
+                    opt.add(constraint)
+        for c in compiled.constraints:
+            if c.install:
+                opt.add(Or([x[p['id']] for p in c.candidates]))
+        for pid in compiled.forbidden:
+            if pid in x:
+                opt.add(Not(x[pid]))
+        for pid in cone.ids:
+            for group in cone.groups[pid]:
+                options = [supports(pid, cid) for cid in group]
+                opt.add(Implies(x[pid], Or(options)) if options else Not(x[pid]))
+            for cid in cone.conflicts[pid]:
+                if cid in x and (pid not in exclusive or exclusive.get(cid) != exclusive[pid]):
+                    opt.add(Implies(x[pid], Not(x[cid])))
+            if pid in state_ids:
+                opt.add_soft(x[pid], uninstall_cost, 'cost')
+                soft += 1
+            else:
+                weight = store.weights[store.row(pid)]
+                if weight > 0:
+                    opt.add_soft(Not(x[pid]), weight, 'cost')
+                    soft += 1
+                opt.add_soft(Not(x[pid]), 1, 'packages')
+                soft += 1
+        return opt, x, soft, len(x) + len(position)
+
+    def add_deps(self, pid, order_by):
+        depends = self.repo.store.view(pid).depends
+        for dlist in depends:
+            if len(dlist) == 1:
+                must_be_installed = 1
+            else:
+                must_be_installed = 0
+            for dep in dlist:
+                rows = self.repo.packages_named(compile_vstring(dep).name)
+                # What "SELECT ... WHERE name = %s ORDER BY <order_by>" returned, or every version lightest first if
+                # that was nothing, narrowed down to the versions the dependency accepts
+                candidates = self.repo.resolve(dep)
+                packages = [p for p in ordered(rows, order_by) or ordered(rows, 'weight ASC') if p['id'] in candidates]
+                if len(packages) != 0:
+                    self.add_dep_to_db(must_be_installed, self.opt_dep_group, packages, pid)
+            self.opt_dep_group += 1
+        self.conn.commit()
+
+    def add_dep_to_db(self, must_be_installed, opt_dep_group, packages, pid):
+        depid = packages[0]['id']
+        try:
+            self.c.execute(
+                "INSERT INTO depends(package_id, depend_package_id, must_be_installed, opt_dep_group) VALUES (%s, %s, %s, %s)",
+                [pid, depid, must_be_installed, opt_dep_group])
+        except pymysql.IntegrityError:
+            pass
+
+    def add_dep_to_installs(self, package_id, order_by):
+        # Depth first over the dependency cone with an explicit stack instead of recursion, so deep chains can't hit
+        # the recursion limit. A frame is [package, depends rows still to go through, dependencies, row waiting on
+        # the frame above it], the last one being the edge whose dependency is being expanded.
+        if package_id in self.seen:
+            return
+        stack = [self.expand(package_id, order_by)]
+        while stack:
+            frame = stack[-1]
+            if frame is None:
+                stack.pop()
+                continue
+            pid, rows, dependencies, waiting = frame
+            if waiting is not None:
+                frame[3] = None
+                self.add_dep_edge(pid, waiting, dependencies)
+                continue
+            d = next(rows, None)
+            if d is None:
+                stack.pop()
+                self.installs.update(dependencies)
+                continue
+            depend_id = d['depend_package_id']
+            self.add_deps(depend_id, order_by)
+            self.repo.add_conflicts(depend_id)
+            self.add_conflict_to_uninstalls(depend_id)
+            if depend_id not in self.installs and depend_id not in self.seen:
+                frame[3] = d
+                stack.append(self.expand(depend_id, order_by))
+            else:
+                self.add_dep_edge(pid, d, dependencies)
+
+    def expand(self, package_id, order_by):
+        # Marks the package as expanded and returns its frame, or None if it ended up with no dependencies
+        c = self.c
+        self.seen.add(package_id)
+        self.add_deps(package_id, order_by)
+        self.repo.add_conflicts(package_id)
+        if package_id in self.uninstalls:
+            tmp = []
+        else:
+            c.execute(
+                "SELECT depend_package_id, opt_dep_group, weight, must_be_installed, weight FROM depends, packages WHERE package_id = %s AND packages.id = %s ORDER BY weight ASC",
+                [package_id, package_id])
+            tmp = c.fetchall()  # Only get ID
+        if len(tmp) != 0:
+            return [package_id, iter(tmp), [], None]
+        self.add_conflict_to_uninstalls(package_id)
+        if not self.compiled.is_required(package_id):
+            self.G.add_node(package_id, required=0, opt_dep_group=-1, conflict=False)
+        self.installs_no_deps.append(package_id)
+        return None
+
+    def add_dep_edge(self, package_id, d, dependencies):
+        self.G.add_node(d['depend_package_id'], opt_dep_group=d['opt_dep_group'], required=0,
+                        weight=d['weight'], conflict=False)
+        self.G.add_dep_edge(package_id, d['depend_package_id'])
+        if d['depend_package_id'] not in dependencies:
+            dependencies.append(d['depend_package_id'])
+
+    def add_conflict_to_uninstalls(self, package_id):
+        c = self.c
+        G = self.G
+        self.repo.add_conflicts(package_id)
+        c.execute("SELECT conflict_package_id FROM conflicts WHERE package_id = %s", [package_id])
+        tmp = c.fetchall()
+        for con in tmp:
+            if not self.compiled.is_required(con['conflict_package_id']):
+                G.add_node(con['conflict_package_id'], conflict=True)
+                self.all_conflicts.add(con['conflict_package_id'])
+            G.add_conflict_edge(package_id, con['conflict_package_id'])
+            self.uninstalls.add(con['conflict_package_id'])
+
+    def run_strategy(self, initial, compiled, order):
+        # z3 takes longer to import than most lockfile checks take to run, so only load it here
+        from .z3 import Solver, Bool, Not, Or, And, unknown, unsat
+
+        c = self.c
+        conn = self.conn
+        metrics = self.metrics
+        # Left behind if the last solve on this connection stopped half way through a strategy
+        self.drop_strategy_tables()
+        c.execute(depends_db)
+        conn.commit()
+
+        G = self.G = Graph()
+
+        self.compiled = compiled
+        compiled.choose(order)
+        self.installs = set(compiled.installs)
+        self.uninstalls = set(compiled.forbidden)
+        self.installs_no_deps = []
+        store = self.repo.store
+        steps = []
+        install_order_ids = set()
+        all_conflicts = self.all_conflicts = set()
+        self.seen = set()
+
+        # Setup the state
+        state_ids = set(self.initial_ids(initial, order))
+
+        # Uninstalls from constraints
+        for n in self.uninstalls:
+            if n in state_ids:
+                steps.append(-n)
+                install_order_ids.add(n)
+
+        # Do everything basically
+        with metrics.phase('cone', order):
+            for i in compiled.installs:
+                # print("Install: " + str(i))
+                G.add_node(i, required=1, opt_dep_group=-1, conflict=False)
+                self.add_dep_to_installs(i, order)
+        metrics.count('nodes', len(G), order)
+        metrics.count('edges', len(G.dep_src) + len(G.conflict_src), order)
+
+        solver = Solver()
+
+        var_mapping = {}
+        node_groups = []
+        trues = []
+
+        # Pseudocode
+
+        # Go through graph in reverse order
+        # Get all the direct descendants of a node
+        # These must be conflicts or dependencies
+        # So And([list of direct descendants])
+        # Inside the And we also may have Or, which would be the optional dependency groups
+        # Then get the direct descendents of these nodes etc. etc.
+        # Eventually we will have translated the whole graph structure to a SAT problem, can solve this and get what
+        # we need to install
+
+        # Keeps one node of every cycle, which is what makes the reversed graph sortable below
+        with metrics.phase('cycles', order):
+            metrics.count('cycle_nodes_removed', len(G.remove_cycles()), order)
+
+        with metrics.phase('encoding', order):
+            ids = G.ids
+            for i in range(len(ids)):
+                if not G.alive[i]:
+                    continue
+                node_descendant = []
+                var_groups = {}
+                for d in G.successor_indices(i):
+                    descendant = ids[d]
+                    if G.conflict[d] == 1:
+                        v = Bool(descendant)
+                        node_descendant.append(Not(v))
+                        var_mapping[descendant] = v
+                    elif G.required[d] == 1:
+                        node_descendant.append(True)
+                        trues.append(descendant)
+                    else:
+                        v = Bool(descendant)
+                        var_groups.setdefault(G.opt_dep_group[d], []).append(v)
+                        var_mapping[descendant] = v
+
+                ors = []
+                for var_group in var_groups:
+                    ors.append(Or(var_groups[var_group]))
+                if ors:
+                    node_descendant.append(And(ors))
+                if node_descendant:
+                    node_groups.append(And(node_descendant))
+
+            solver.add(And(node_groups))
+        metrics.count('variables', len(var_mapping), order)
+        metrics.count('constraints', len(node_groups), order)
+
+        # nx.draw(G.to_networkx(), with_labels=True)
+        # plt.show()
+
+        r = self.check(solver, order, len(var_mapping), len(node_groups))
+
+        if r == unsat or r == unknown:
+            self.drop_strategy_tables()
+            return Plan(None, strategy=order if r == unsat else 'timeout')
+
+        with metrics.phase('order', order):
+            true_vars = true_ids(solver.model())
+
+            for node in G.nodes():
+                if node in var_mapping and node not in trues and node not in true_vars and node not in state_ids:
+                    G.remove_node(node)
+
+            cost = 0
+
+            for n in G.reverse().topological_sort():
+                if n not in all_conflicts and n not in install_order_ids and n not in state_ids:
+                    steps.append(n)
+                    install_order_ids.add(n)
+                    cost += store.weights[store.row(n)]
+                elif n in state_ids or n in install_order_ids:
+                    # Only uninstall if its in the state, or it's already been installed
+                    steps.append(-n)
+                    install_order_ids.add(n)
+                    cost += uninstall_cost
+
+        self.drop_strategy_tables()
+        return Plan(None, cost, order, steps, store)
+
+    def drop_strategy_tables(self):
+        self.c.execute(del_everything_except_pkg)
+        self.conn.commit()
@@ -0,0 +1,244 @@
+import heapq
+
+from .graph import Graph
+
+# Ways of saying at most one version of a name is installed: pairwise conflicts as written in the repository, a
+# sequential counter (Sinz) with n - 1 auxiliary variables and 3n clauses, or z3's native AtMost
+at_most_one_encodings = ['pairwise', 'sequential', 'atmost']
+
+
+def at_most_one_constraints(xs, encoding='atmost', prefix='amo'):
+    # Constraints letting at most one of the z3 Bools xs be true. prefix names the counter's auxiliary variables.
+    from .z3 import AtMost, Bool, Not, Or
+
+    n = len(xs)
+    if n < 2:
+        return []
+    if encoding == 'atmost':
+        return [AtMost(*(xs + [1]))]
+    if encoding == 'pairwise':
+        return [Or(Not(xs[i]), Not(xs[j])) for i in range(n) for j in range(i + 1, n)]
+    # s[i] is true when one of xs[0..i] is
+    s = [Bool("%s_%d" % (prefix, i)) for i in range(n - 1)]
+    clauses = [Or(Not(xs[0]), s[0])]
+    for i in range(1, n - 1):
+        clauses.append(Or(Not(xs[i]), s[i]))
+        clauses.append(Or(Not(s[i - 1]), s[i]))
+        clauses.append(Or(Not(xs[i]), Not(s[i - 1])))
+    clauses.append(Or(Not(xs[n - 1]), Not(s[n - 2])))
+    return clauses
+
+
+def true_ids(model):
+    # Package ids p with Bool(p) true in the model, in one pass over the model's constants through the C API. Looking
+    # each variable up with model[x] or model.eval(x) wraps every answer in Python objects and searches the model
+    # again each time; this only makes a handful of ctypes calls per constant.
+    from .z3 import Z3_INT_SYMBOL, Z3_L_TRUE
+    from .z3.z3core import (Z3_get_bool_value, Z3_get_decl_name, Z3_get_symbol_int, Z3_get_symbol_kind,
+                           Z3_model_get_const_decl, Z3_model_get_const_interp, Z3_model_get_num_consts)
+
+    ctx = model.ctx.ref()
+    m = model.model
+    ids = set()
+    for i in range(Z3_model_get_num_consts(ctx, m)):
+        decl = Z3_model_get_const_decl(ctx, m, i)
+        if Z3_get_bool_value(ctx, Z3_model_get_const_interp(ctx, m, decl)) == Z3_L_TRUE:
+            # Bool(pid) has an integer symbol, the auxiliary variables have names
+            symbol = Z3_get_decl_name(ctx, decl)
+            if Z3_get_symbol_kind(ctx, symbol) == Z3_INT_SYMBOL:
+                ids.add(Z3_get_symbol_int(ctx, symbol))
+    return ids
+
+
+class DependencyCone:
+    # Every package reachable from the roots through any alternative of any depends group. For each package it keeps
+    # one list of candidate ids per depends group (every version of every alternative in the group) and the ids it
+    # conflicts with. Candidates come from repo.resolve, so each dependency or conflict string is matched against
+    # the index once however many packages mention it.
+
+    def __init__(self, repo, roots):
+        store = repo.store
+        self.ids = []
+        self.groups = {}
+        self.conflicts = {}
+        self.name_ids = {}
+
+        seen = set()
+        stack = []
+        for pid in roots:
+            if pid not in seen:
+                seen.add(pid)
+                stack.append(pid)
+        while stack:
+            pid = stack.pop()
+            self.ids.append(pid)
+            row = store.row(pid)
+            self.name_ids[pid] = store.name_ids[row]
+
+            groups = []
+            for dlist in store.depends(row):
+                candidates = list(dict.fromkeys(cid for dep in dlist for cid in repo.resolve(dep)))
+                for cid in candidates:
+                    if cid not in seen:
+                        seen.add(cid)
+                        stack.append(cid)
+                groups.append(candidates)
+            self.groups[pid] = groups
+            # A package listing itself among its conflicts can still be installed on its own
+            self.conflicts[pid] = [cid for conflict in store.conflicts(row) for cid in repo.resolve(conflict)
+                                   if cid != pid]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, pid):
+        return pid in self.groups
+
+    def exclusive_groups(self):
+        # Ids of the versions of each name in the cone whose versions all conflict with each other, for names with
+        # more than two of them. Their conflicts among themselves can be written as one at most one group.
+        versions = {}
+        for pid in self.ids:
+            versions.setdefault(self.name_ids[pid], []).append(pid)
+        pairs = set()
+        for pid in self.ids:
+            for cid in self.conflicts[pid]:
+                if self.name_ids.get(cid) == self.name_ids[pid]:
+                    pairs.add((min(pid, cid), max(pid, cid)))
+        count = {}
+        for pid, _ in pairs:
+            count[self.name_ids[pid]] = count.get(self.name_ids[pid], 0) + 1
+        # Every pair of k versions conflicting is k(k - 1) / 2 distinct pairs
+        return [pids for name_id, pids in versions.items()
+                if len(pids) > 2 and count.get(name_id, 0) == len(pids) * (len(pids) - 1) // 2]
+
+    def components(self):
+        # Package id -> component number for packages on a dependency cycle (through any alternative). Within a
+        # component a package can't be installed on the strength of another until that one has been installed.
+        G = Graph()
+        for pid in self.ids:
+            G.add_node(pid)
+            for group in self.groups[pid]:
+                for cid in group:
+                    G.add_dep_edge(pid, cid)
+        component = {}
+        for n, members in enumerate(G.strongly_connected_components()):
+            if len(members) > 1:
+                for i in members:
+                    component[G.ids[i]] = n
+        return component
+
+    def plan_order(self, chosen, present):
+        # Steps taking the state present to chosen, -pid for a removal and pid for an install, with every state on the
+        # way meeting its depends and free of conflicts, or None if there is no such order. Removals and installs
+        # share one ready queue: a removal is ready once no installed package relies on it alone for a depends
+        # group, an install once each of its groups has a candidate installed (a package counts for its own
+        # depends) and nothing installed conflicts with it either way. Removals go first when both are ready, and
+        # otherwise steps are taken in cone order. Counters per installed package and depends group are kept as in
+        # validate.Replay, so each step only touches the packages it is a candidate or conflict of.
+        index = dict((pid, n) for n, pid in enumerate(self.ids))
+        installed = set(pid for pid in present if pid in index)
+        removals = installed.difference(chosen)
+        installs = set(chosen).difference(installed)
+
+        groups = {}
+        counts = {}
+        watchers = {}
+        conflicting = {}
+        for pid in installed.union(installs):
+            groups[pid] = [group for group in self.groups[pid] if pid not in group]
+            counts[pid] = [sum(1 for cid in group if cid in installed) for group in groups[pid]]
+            for g, group in enumerate(groups[pid]):
+                for cid in group:
+                    watchers.setdefault(cid, []).append((pid, g))
+            for cid in self.conflicts[pid]:
+                conflicting.setdefault(pid, set()).add(cid)
+                conflicting.setdefault(cid, set()).add(pid)
+
+        def sole(pid, g, but=None):
+            # The one installed candidate of the group, other than but
+            return next(cid for cid in groups[pid][g] if cid in installed and cid != but)
+
+        # installed package -> number of (package, group) it is the only installed candidate of
+        relied = dict.fromkeys(installed, 0)
+        for pid in installed:
+            for g, n in enumerate(counts[pid]):
+                if n == 1:
+                    relied[sole(pid, g)] += 1
+        # package to install -> depends groups with no candidate installed, installed packages it conflicts with
+        missing = dict((pid, counts[pid].count(0)) for pid in installs)
+        clashes = dict((pid, len(conflicting.get(pid, set()).intersection(installed))) for pid in installs)
+
+        ready_removals = [(index[pid], pid) for pid in removals if relied[pid] == 0]
+        ready_installs = [(index[pid], pid) for pid in installs if missing[pid] == 0 and clashes[pid] == 0]
+        heapq.heapify(ready_removals)
+        heapq.heapify(ready_installs)
+
+        def install(pid):
+            for g, n in enumerate(counts[pid]):
+                if n == 1:
+                    relied[sole(pid, g)] += 1
+            installed.add(pid)
+            relied[pid] = 0
+            for other, g in watchers.get(pid, ()):
+                counts[other][g] += 1
+                if other in installed:
+                    if counts[other][g] == 1:
+                        relied[pid] += 1
+                    elif counts[other][g] == 2:
+                        cid = sole(other, g, pid)
+                        relied[cid] -= 1
+                        if relied[cid] == 0 and cid in removals:
+                            heapq.heappush(ready_removals, (index[cid], cid))
+                elif other in installs and counts[other][g] == 1:
+                    missing[other] -= 1
+                    if missing[other] == 0 and clashes[other] == 0:
+                        heapq.heappush(ready_installs, (index[other], other))
+            for cid in conflicting.get(pid, ()):
+                if cid in installs:
+                    clashes[cid] += 1
+
+        def remove(pid):
+            for g, n in enumerate(counts[pid]):
+                if n == 1:
+                    cid = sole(pid, g)
+                    relied[cid] -= 1
+                    if relied[cid] == 0 and cid in removals:
+                        heapq.heappush(ready_removals, (index[cid], cid))
+            installed.discard(pid)
+            for other, g in watchers.get(pid, ()):
+                counts[other][g] -= 1
+                if other in installed:
+                    if counts[other][g] == 1:
+                        relied[sole(other, g)] += 1
+                elif other in installs and counts[other][g] == 0:
+                    missing[other] += 1
+            for cid in conflicting.get(pid, ()):
+                if cid in installs:
+                    clashes[cid] -= 1
+                    if clashes[cid] == 0 and missing[cid] == 0:
+                        heapq.heappush(ready_installs, (index[cid], cid))
+
+        steps = []
+        while removals or installs:
+            # Entries are pushed when they become ready and checked again when popped, since a removal stops being
+            # ready if a package comes to rely on it alone in the meantime, and an install if the candidate it was
+            # waiting on is removed
+            while ready_removals and (ready_removals[0][1] not in removals or relied[ready_removals[0][1]] > 0):
+                heapq.heappop(ready_removals)
+            while ready_installs and (ready_installs[0][1] not in installs or missing[ready_installs[0][1]] > 0
+                                      or clashes[ready_installs[0][1]] > 0):
+                heapq.heappop(ready_installs)
+            if ready_removals:
+                pid = heapq.heappop(ready_removals)[1]
+                removals.discard(pid)
+                remove(pid)
+                steps.append(-pid)
+            elif ready_installs:
+                pid = heapq.heappop(ready_installs)[1]
+                installs.discard(pid)
+                install(pid)
+                steps.append(pid)
+            else:
+                return None
+        return steps
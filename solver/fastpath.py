@@ -0,0 +1,60 @@
+from .matching import compile_vstring, matches
+
+fast_paths = ['satisfied', 'leaf', 'missing']
+
+
+def split(package):
+    name, version = package.split("=")
+    return name, version
+
+
+def is_installed(initial, version_string):
+    return any(matches(version_string, *split(i)) for i in initial)
+
+
+def satisfied(initial, constraints):
+    # Every + is installed already and nothing installed is ruled out by a -, so there is nothing to do
+    if not all("=" in i for i in initial):
+        return False
+    return all((constraint[0] == "+") == is_installed(initial, constraint[1:]) for constraint in constraints)
+
+
+def classify(repo, initial, constraints):
+    # Returns (fast path, commands, cost) for requests that don't need a solve, commands being None for no solution,
+    # or (None, None, 0) when the full pipeline has to run
+    if satisfied(initial, constraints):
+        return 'satisfied', [], 0
+    if not all("=" in i for i in initial):
+        return None, None, 0
+
+    installs = [constraint[1:] for constraint in constraints if constraint[0] == "+"]
+    uninstalls = [constraint[1:] for constraint in constraints if constraint[0] == "-"]
+    packages = repo.find_packages(set(compile_vstring(i).name for i in installs) | set(split(i)[0] for i in initial))
+
+    candidates = {}
+    for install in installs:
+        name = compile_vstring(install).name
+        candidates[install] = [p for p in packages.get(name, []) if matches(install, name, p['version'])]
+        if not candidates[install]:
+            return 'missing', None, 0
+
+    missing = [install for install in installs if not is_installed(initial, install)]
+    if len(missing) != 1 or any(is_installed(initial, uninstall) for uninstall in uninstalls):
+        return None, None, 0
+
+    # A single package to add on top of the initial state. If the cheapest candidate has no depends and nothing
+    # installed conflicts with it, nothing else can come out cheaper.
+    allowed = [p for p in candidates[missing[0]]
+               if not any(matches(uninstall, p['name'], p['version']) for uninstall in uninstalls)]
+    if not allowed:
+        return None, None, 0
+    best = min(allowed, key=lambda p: p['weight'])
+    if best['depends'] or best['conflicts']:
+        return None, None, 0
+    for i in initial:
+        name, version = split(i)
+        for p in packages.get(name, []):
+            if p['version'] == version and any(matches(conflict, best['name'], best['version'])
+                                               for conflict in p['conflicts']):
+                return None, None, 0
+    return 'leaf', ["+" + best['name'] + "=" + best['version']], best['weight']
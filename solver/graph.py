@@ -0,0 +1,236 @@
+from array import array
+
+# Marks a node attribute that has never been set
+unset = -(1 << 31)
+
+
+class Graph:
+    # Directed graph over package ids. Nodes get dense indices in the order they are first seen and their attributes
+    # live in typed columns. Dependency and conflict edges are kept in separate edge arrays until freeze() turns them
+    # into CSR adjacency (successors of node i are targets[offsets[i]:offsets[i + 1]]). Removing a node only clears
+    # its alive flag.
+
+    def __init__(self):
+        self.index = {}
+        self.ids = array('i')
+        self.alive = bytearray()
+        self.opt_dep_group = array('i')
+        self.required = array('i')
+        self.weight = array('q')
+        self.conflict = array('i')
+
+        self.dep_src = array('i')
+        self.dep_dst = array('i')
+        self.conflict_src = array('i')
+        self.conflict_dst = array('i')
+
+        self.offsets = None
+        self.targets = None
+
+    def node(self, pid):
+        i = self.index.get(pid)
+        if i is None:
+            i = self.index[pid] = len(self.ids)
+            self.ids.append(pid)
+            self.alive.append(1)
+            self.opt_dep_group.append(unset)
+            self.required.append(unset)
+            self.weight.append(0)
+            self.conflict.append(unset)
+            self.offsets = None
+        return i
+
+    def add_node(self, pid, opt_dep_group=None, required=None, weight=None, conflict=None):
+        # Like networkx, attributes given overwrite the old ones and the others are left alone
+        i = self.node(pid)
+        self.alive[i] = 1
+        if opt_dep_group is not None:
+            self.opt_dep_group[i] = opt_dep_group
+        if required is not None:
+            self.required[i] = required
+        if weight is not None:
+            self.weight[i] = weight
+        if conflict is not None:
+            self.conflict[i] = 1 if conflict else 0
+
+    def add_dep_edge(self, pid, depend_pid):
+        self.dep_src.append(self.node(pid))
+        self.dep_dst.append(self.node(depend_pid))
+        self.offsets = None
+
+    def add_conflict_edge(self, pid, conflict_pid):
+        self.conflict_src.append(self.node(pid))
+        self.conflict_dst.append(self.node(conflict_pid))
+        self.offsets = None
+
+    def __len__(self):
+        return sum(self.alive)
+
+    def __contains__(self, pid):
+        i = self.index.get(pid)
+        return i is not None and self.alive[i] == 1
+
+    def remove_node(self, pid):
+        i = self.index.get(pid)
+        if i is not None:
+            self.alive[i] = 0
+
+    def remove_nodes_from(self, pids):
+        for pid in pids:
+            self.remove_node(pid)
+
+    def nodes(self):
+        return [self.ids[i] for i in range(len(self.ids)) if self.alive[i]]
+
+    def freeze(self):
+        # Counting sort of both edge arrays by source into CSR, dropping repeated edges
+        if self.offsets is not None:
+            return
+        n = len(self.ids)
+        src = self.dep_src + self.conflict_src
+        dst = self.dep_dst + self.conflict_dst
+        counts = array('i', bytes(4 * (n + 1)))
+        for u in src:
+            counts[u + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        fill = array('i', counts)
+        targets = array('i', bytes(4 * len(src)))
+        for u, v in zip(src, dst):
+            targets[fill[u]] = v
+            fill[u] += 1
+
+        offsets = array('i', [0])
+        unique = array('i')
+        for u in range(n):
+            seen = set()
+            for v in targets[counts[u]:counts[u + 1]]:
+                if v not in seen:
+                    seen.add(v)
+                    unique.append(v)
+            offsets.append(len(unique))
+        self.offsets = offsets
+        self.targets = unique
+
+    def successor_indices(self, i):
+        self.freeze()
+        alive = self.alive
+        return [v for v in self.targets[self.offsets[i]:self.offsets[i + 1]] if alive[v]]
+
+    def successors(self, pid):
+        return [self.ids[v] for v in self.successor_indices(self.index[pid])]
+
+    def reverse(self):
+        # A graph with the same nodes and attributes and every edge turned around
+        r = Graph()
+        r.index = dict(self.index)
+        r.ids = array('i', self.ids)
+        r.alive = bytearray(self.alive)
+        r.opt_dep_group = array('i', self.opt_dep_group)
+        r.required = array('i', self.required)
+        r.weight = array('q', self.weight)
+        r.conflict = array('i', self.conflict)
+        r.dep_src, r.dep_dst = array('i', self.dep_dst), array('i', self.dep_src)
+        r.conflict_src, r.conflict_dst = array('i', self.conflict_dst), array('i', self.conflict_src)
+        return r
+
+    def strongly_connected_components(self):
+        # Iterative Tarjan over the live nodes, components come out as lists of node indices
+        self.freeze()
+        n = len(self.ids)
+        order = array('i', [-1] * n)
+        low = array('i', [0] * n)
+        on_stack = bytearray(n)
+        stack = []
+        components = []
+        counter = 0
+        for root in range(n):
+            if not self.alive[root] or order[root] != -1:
+                continue
+            work = [(root, iter(self.successor_indices(root)))]
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            while work:
+                u, successors = work[-1]
+                advanced = False
+                for v in successors:
+                    if order[v] == -1:
+                        order[v] = low[v] = counter
+                        counter += 1
+                        stack.append(v)
+                        on_stack[v] = 1
+                        work.append((v, iter(self.successor_indices(v))))
+                        advanced = True
+                        break
+                    elif on_stack[v] and order[v] < low[u]:
+                        low[u] = order[v]
+                if advanced:
+                    continue
+                work.pop()
+                if work and low[u] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[u]
+                if low[u] == order[u]:
+                    component = []
+                    while True:
+                        v = stack.pop()
+                        on_stack[v] = 0
+                        component.append(v)
+                        if v == u:
+                            break
+                    components.append(component)
+        return components
+
+    def remove_cycles(self):
+        # Keeps the first seen node of every cycle and drops the rest of it, returns the package ids removed
+        removed = []
+        for component in self.strongly_connected_components():
+            if len(component) > 1:
+                keep = min(component)
+                for i in component:
+                    if i != keep:
+                        self.alive[i] = 0
+                        removed.append(self.ids[i])
+        return removed
+
+    def topological_sort(self):
+        # Kahn's algorithm over the live nodes, ties broken by insertion order. Self loops are ignored.
+        self.freeze()
+        n = len(self.ids)
+        indegree = array('i', [0] * n)
+        for u in range(n):
+            if self.alive[u]:
+                for v in self.successor_indices(u):
+                    if v != u:
+                        indegree[v] += 1
+        ready = [u for u in range(n) if self.alive[u] and indegree[u] == 0]
+        ready.reverse()
+        order = []
+        while ready:
+            u = ready.pop()
+            order.append(self.ids[u])
+            for v in reversed(self.successor_indices(u)):
+                if v != u:
+                    indegree[v] -= 1
+                    if indegree[v] == 0:
+                        ready.append(v)
+        return order
+
+    def to_networkx(self):
+        # For debugging only, e.g. nx.draw(graph.to_networkx(), with_labels=True)
+        import networkx as nx
+        G = nx.DiGraph()
+        for i, pid in enumerate(self.ids):
+            if self.alive[i]:
+                attrs = {}
+                for key, column in (('opt_dep_group', self.opt_dep_group), ('required', self.required),
+                                    ('conflict', self.conflict)):
+                    if column[i] != unset:
+                        attrs[key] = column[i]
+                G.add_node(pid, weight=self.weight[i], **attrs)
+        for i in range(len(self.ids)):
+            if self.alive[i]:
+                for v in self.successor_indices(i):
+                    G.add_edge(self.ids[i], self.ids[v])
+        return G
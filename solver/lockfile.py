@@ -0,0 +1,62 @@
+import json
+import os
+
+from .matching import compile_vstring, matches
+
+
+def read_lock(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_lock(path, initial, commands):
+    # The lock holds the state after the plan has been applied to the initial state
+    installed = set(initial)
+    for command in commands:
+        if command[0] == "+":
+            installed.add(command[1:])
+        else:
+            installed.discard(command[1:])
+    with open(path, 'w') as f:
+        json.dump(sorted(installed), f, indent=1)
+
+
+def by_name(installed):
+    names = {}
+    for package in installed:
+        name, version = package.split("=")
+        names.setdefault(name, []).append(version)
+    return names
+
+
+def find_all(names, version_string):
+    name = compile_vstring(version_string).name
+    for version in names.get(name, []):
+        if matches(version_string, name, version):
+            yield name + "=" + version
+
+
+def find(names, version_string):
+    return next(find_all(names, version_string), None)
+
+
+def check_lock(installed, packages, constraints):
+    # packages maps name=version to the repository entry for every member of the lock that still exists
+    if any(package not in packages for package in installed):
+        return False
+    names = by_name(installed)
+    for package in installed:
+        for dlist in packages[package]['depends']:
+            if not any(find(names, dep) for dep in dlist):
+                return False
+        for conflict in packages[package]['conflicts']:
+            if any(found != package for found in find_all(names, conflict)):
+                return False
+    for constraint in constraints:
+        found = find(names, constraint[1:])
+        if (constraint[0] == "+") != (found is not None):
+            return False
+    return True
+
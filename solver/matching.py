@@ -0,0 +1,76 @@
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+from operator import ge, le, eq, lt, gt
+
+# Bounds on the interning caches, the same few thousand dependency strings come up over and over
+max_matchers = 1 << 16
+max_versions = 1 << 16
+
+
+def parse_vstring(version_string):
+    if ">=" in version_string:
+        return (version_string.split(">=")[0], version_string.split(">=")[1], ge)
+    elif "<=" in version_string:
+        return (version_string.split("<=")[0], version_string.split("<=")[1], le)
+    elif "=" in version_string:
+        return (version_string.split("=")[0], version_string.split("=")[1], eq)
+    elif "<" in version_string:
+        return (version_string.split("<")[0], version_string.split("<")[1], lt)
+    elif ">" in version_string:
+        return (version_string.split(">")[0], version_string.split(">")[1], gt)
+    else:
+        return version_string, None, None
+
+
+@lru_cache(maxsize=max_versions)
+def version_key(version):
+    # packaging takes a while to import and bare names never compare versions, so it's only loaded once one does
+    from packaging import version as vparser
+    return vparser.parse(version)
+
+
+class Matcher:
+    __slots__ = ('name', 'op', 'version', 'key')
+
+    def __init__(self, version_string):
+        name, version, op = parse_vstring(version_string)
+        self.name = sys.intern(name)
+        self.op = op if version is not None else None
+        self.version = version
+        self.key = version_key(version) if self.op is not None else None
+
+    def matches(self, version):
+        return self.op is None or self.op(version_key(version), self.key)
+
+
+@lru_cache(maxsize=max_matchers)
+def compile_vstring(version_string):
+    return Matcher(version_string)
+
+
+def matches(version_string, name, version):
+    matcher = compile_vstring(version_string)
+    return matcher.name == name and matcher.matches(version)
+
+
+class BoundedCache:
+    # Least recently used entries are dropped once there are more than max_entries
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
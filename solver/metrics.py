@@ -0,0 +1,143 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Size at which the solver log is moved to PATH.1 and started again
+solver_log_bytes = 10 << 20
+
+
+def solver_statistics(solver):
+    # Everything z3 counted during the last check (conflicts, decisions, propagations, memory, rlimit count, ...)
+    statistics = solver.statistics()
+    return dict((key, statistics.get_key_value(key)) for key in statistics.keys())
+
+
+def append_solver_log(path, record, max_bytes=solver_log_bytes):
+    # One JSON line per solve. Only the current file and the one before it are kept.
+    try:
+        if os.path.getsize(path) >= max_bytes:
+            os.replace(path, path + ".1")
+    except OSError:
+        pass
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def max_rss():
+    # Peak resident set size of the process in bytes, None where the resource module doesn't exist
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Metrics:
+    # Wall and CPU time per phase (and per strategy for phases run once per strategy), counts and other facts about a
+    # run, written out as JSON for monitoring. Phases that run more than once add up.
+    #
+    # With memory=True each phase also records the tracemalloc peak above what was allocated when it started and the
+    # process's max RSS when it ended, and the allocation sites that grew most during the phase with the highest peak
+    # are kept. tracemalloc makes everything several times slower, so this is off by default.
+    #
+    # With sql=True, queries is a QueryTrace that cursors from Repository.cursor() report every statement to.
+
+    def __init__(self, memory=False, top_sites=10, sql=False):
+        self.phases = {}
+        self.strategies = {}
+        self.counts = {}
+        self.info = {}
+        # Names of the phases running, innermost last
+        self.stack = []
+        self.queries = None
+        if sql:
+            from .sqltrace import QueryTrace
+            self.queries = QueryTrace(self)
+        self.memory = memory
+        self.top_sites = top_sites
+        # One [traced at start, highest peak of phases inside it] per phase running
+        self.running = []
+        self.worst_peak = -1
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name, strategy=None):
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            self.running.append([tracemalloc.get_traced_memory()[0], 0])
+            if hasattr(tracemalloc, 'reset_peak'):
+                # Python 3.9 and later, before that peaks are since tracing started
+                tracemalloc.reset_peak()
+        self.stack.append(name)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            self.add(self.phases, name, wall, cpu)
+            if strategy is not None:
+                self.add(self.strategy(strategy)['phases'], name, wall, cpu)
+            if self.memory:
+                self.end_memory(name, snapshot)
+
+    def end_memory(self, name, snapshot):
+        start, inner_peak = self.running.pop()
+        # A phase inside this one reset the peak when it started, so its peak counts too
+        peak = max(tracemalloc.get_traced_memory()[1], inner_peak)
+        for outer in self.running:
+            outer[1] = max(outer[1], peak)
+        totals = self.phases[name]
+        totals['tracemalloc_peak'] = max(totals.get('tracemalloc_peak', 0), peak - start)
+        totals['max_rss'] = max_rss()
+        if peak - start > self.worst_peak:
+            self.worst_peak = peak - start
+            ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            top = tracemalloc.take_snapshot().filter_traces(ignore).compare_to(snapshot.filter_traces(ignore),
+                                                                                'lineno')[:self.top_sites]
+            self.info['memory'] = {'worst_phase': name, 'tracemalloc_peak': peak - start, 'top_sites': [
+                {'site': str(stat.traceback), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+                for stat in top]}
+
+    @staticmethod
+    def add(phases, name, wall, cpu):
+        totals = phases.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        totals['wall'] += wall
+        totals['cpu'] += cpu
+        totals['calls'] += 1
+
+    def strategy(self, strategy):
+        return self.strategies.setdefault(strategy, {'phases': {}, 'counts': {}})
+
+    def count(self, name, n=1, strategy=None):
+        self.counts[name] = self.counts.get(name, 0) + n
+        if strategy is not None:
+            counts = self.strategy(strategy)['counts']
+            counts[name] = counts.get(name, 0) + n
+
+    def add_checks(self, checks):
+        # Solver statistics of each check, kept per strategy
+        for check in checks:
+            self.strategy(check['strategy']).setdefault('checks', []).append(check)
+
+    def set(self, name, value):
+        self.info[name] = value
+
+    def to_dict(self):
+        if self.memory:
+            self.info['max_rss'] = max_rss()
+        if self.queries is not None:
+            self.info['sql'] = self.queries.report()
+        return dict(self.info, phases=self.phases, strategies=self.strategies, counts=self.counts)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
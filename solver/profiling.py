@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+profile_modes = ['cprofile', 'sample']
+default_paths = {'cprofile': 'profile.pstats', 'sample': 'profile.folded'}
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Sampler:
+    # Samples the stack of one thread from a background thread hz times a second and counts each distinct stack.
+    # write() gives the collapsed format flamegraph tools read: "outer;...;inner count" per line.
+
+    def __init__(self, thread_id, hz=100):
+        self.thread_id = thread_id
+        self.interval = 1.0 / hz
+        self.stacks = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write("%s %d\n" % (stack, count))
+
+
+@contextmanager
+def profiled(mode, path=None, hz=100):
+    # Profiles the block with cProfile (a pstats file) or the sampler (collapsed stacks), or not at all for mode None
+    if mode is None:
+        yield
+        return
+    if path is None:
+        path = default_paths[mode]
+    if mode == 'cprofile':
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(path)
+    elif mode == 'sample':
+        sampler = Sampler(threading.get_ident(), hz)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write(path)
+            print("profile: %d samples over %.2fs written to %s" % (sampler.samples, time.perf_counter() - start, path),
+                  file=sys.stderr)
+    else:
+        raise ValueError("unknown profile mode %r, expected one of %s" % (mode, ", ".join(profile_modes)))
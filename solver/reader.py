@@ -0,0 +1,32 @@
+import hashlib
+import json
+
+
+def load_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def snapshot_chain(repo_path, delta_paths=(), hash_file=file_hash):
+    # Snapshot after each step: the base repository file, then every delta applied on top of it in order
+    chain = [hash_file(repo_path)]
+    for delta_path in delta_paths:
+        chain.append(hashlib.sha1((chain[-1] + hash_file(delta_path)).encode()).hexdigest())
+    return chain
+
+
+def load_delta(path):
+    delta = load_json(path)
+    return {
+        'added': delta.get('added', []),
+        'removed': delta.get('removed', []),
+        'replaced': delta.get('replaced', []),
+    }
@@ -0,0 +1,312 @@
+import json
+import sys
+
+import pymysql.cursors
+
+from .matching import BoundedCache, compile_vstring, version_key
+from .metrics import Metrics
+from .reader import load_json, load_delta, snapshot_chain
+from .store import PackageStore
+
+no_sql_notes = "SET sql_notes = 0"
+
+package_db = \
+    '''
+    CREATE TABLE packages (
+        id INTEGER PRIMARY KEY AUTO_INCREMENT,
+        name VARCHAR(255),
+        version VARCHAR(255),
+        version_rank INTEGER DEFAULT 0,
+        weight INTEGER,
+        depends TEXT,
+        conflicts TEXT,
+        conflicts_done TINYINT DEFAULT 0,
+        INDEX (name, version)
+    );
+    '''
+
+conflicts_db = \
+    """
+    CREATE TABLE conflicts (
+        package_id INTEGER,
+        conflict_package_id INTEGER,
+        PRIMARY KEY (package_id, conflict_package_id),
+        FOREIGN KEY (package_id) REFERENCES packages(id),
+        FOREIGN KEY (conflict_package_id) REFERENCES packages(id)
+    );
+    """
+
+# Reverse dependency index: every name a package mentions in its depends or conflicts
+rdepends_db = \
+    """
+    CREATE TABLE rdepends (
+        name VARCHAR(255),
+        package_id INTEGER,
+        PRIMARY KEY (name, package_id)
+    );
+    """
+
+meta_db = \
+    """
+    CREATE TABLE repo_meta (
+        k VARCHAR(64) PRIMARY KEY,
+        v VARCHAR(255)
+    );
+    """
+
+insert_package = \
+    "INSERT INTO packages(id, name, version, version_rank, weight, depends, conflicts) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+insert_rdepends = "INSERT IGNORE INTO rdepends(name, package_id) VALUES (%s, %s)"
+
+unset_for_key_check = "SET foreign_key_checks = 0"
+set_for_key_check = "SET foreign_key_checks = 1"
+del_pkg = "DROP TABLE IF EXISTS packages, conflicts, rdepends, repo_meta, depends, state"
+
+
+def make_conn(database='depsolve'):
+    if sys.platform == "darwin":
+        cdbc = pymysql.connect(host='localhost', user='root', password='')
+    else:
+        cdbc = pymysql.connect(unix_socket='/var/run/mysqld/mysqld.sock', user='root', password='')
+    cdbc.cursor().execute(no_sql_notes)
+    cdbc.cursor().execute("CREATE DATABASE IF NOT EXISTS " + database)
+    cdbc.commit()
+    cdbc.close()
+
+    if sys.platform == "darwin":
+        # Connect to the database
+        conn = pymysql.connect(host='localhost',
+                               user='root',
+                               password='',
+                               db=database,
+                               charset='utf8mb4',
+                               cursorclass=pymysql.cursors.DictCursor)
+    else:
+        # Connect to the database
+        conn = pymysql.connect(unix_socket='/var/run/mysqld/mysqld.sock',
+                               user='root',
+                               password='',
+                               db=database,
+                               charset='utf8mb4',
+                               cursorclass=pymysql.cursors.DictCursor)
+    conn.cursor().execute(no_sql_notes)
+    return conn
+
+
+def referenced_names(depends, conflicts):
+    names = set(compile_vstring(dep).name for dlist in depends for dep in dlist)
+    names.update(compile_vstring(conflict).name for conflict in conflicts)
+    return names
+
+
+def rank_versions(rows):
+    # rows are (id, name, version), returns the position of each id among the versions of its name
+    by_name = {}
+    for pid, name, version in rows:
+        by_name.setdefault(name, []).append((version_key(version), pid))
+    ranks = {}
+    for versions in by_name.values():
+        for rank, (_, pid) in enumerate(sorted(versions)):
+            ranks[pid] = rank
+    return ranks
+
+
+class Repository:
+    # The package index in MariaDB. It is kept between runs and tagged with the snapshot it was built from.
+
+    def __init__(self, conn, snapshot=None, database='depsolve', metrics=None):
+        self.conn = conn
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.c = self.cursor()
+        self.snapshot = snapshot
+        self.database = database
+        self._store = None
+        # Candidates of a dependency or conflict string for the current snapshot
+        self.resolved = BoundedCache(1 << 16)
+
+    def cursor(self, cursorclass=None):
+        # A cursor on the index connection, traced when the metrics are collecting queries
+        c = self.conn.cursor(cursorclass)
+        if self.metrics.queries is not None:
+            from .sqltrace import TracedCursor
+            c = TracedCursor(c, self.metrics.queries)
+        return c
+
+    @classmethod
+    def load(cls, repo_path, deltas=(), snapshots=None, database='depsolve', metrics=None):
+        if snapshots is None:
+            snapshots = snapshot_chain(repo_path, deltas)
+        repo = cls(make_conn(database), database=database, metrics=metrics)
+        with repo.metrics.phase('ingest'):
+            repo.sync(repo_path, deltas, snapshots)
+        return repo
+
+    def sync(self, repo_path, deltas, snapshots):
+        # Only rebuild when the index doesn't hold a snapshot we can get to by applying some of the deltas
+        cached = self.get_snapshot()
+        if cached in snapshots:
+            start = snapshots.index(cached)
+        else:
+            self.rebuild_index(load_json(repo_path))
+            self.set_snapshot(snapshots[0])
+            start = 0
+        for delta_path, snapshot in zip(deltas[start:], snapshots[start + 1:]):
+            # Mark the index as unknown while patching so an interrupted delta forces a rebuild next time
+            self.set_snapshot("")
+            self.apply_delta(load_delta(delta_path))
+            self.set_snapshot(snapshot)
+        self.snapshot = snapshots[-1]
+
+    def get_snapshot(self):
+        self.c.execute("SHOW TABLES LIKE 'repo_meta'")
+        if self.c.fetchone() is None:
+            return None
+        self.c.execute("SELECT v FROM repo_meta WHERE k = 'snapshot'")
+        res = self.c.fetchone()
+        return res['v'] if res else None
+
+    def set_snapshot(self, snapshot):
+        self.c.execute("REPLACE INTO repo_meta(k, v) VALUES ('snapshot', %s)", [snapshot])
+        self.conn.commit()
+
+    def rebuild_index(self, repository):
+        c = self.c
+        self._store = None
+        self.resolved.clear()
+        c.execute(unset_for_key_check)
+        c.execute(del_pkg)
+        c.execute(set_for_key_check)
+        c.execute(package_db)
+        c.execute(conflicts_db)
+        c.execute(rdepends_db)
+        c.execute(meta_db)
+
+        ranks = rank_versions((pid, p['name'], p['version']) for pid, p in enumerate(repository, 1))
+        rows = []
+        rdeps = []
+        for pid, p in enumerate(repository, 1):
+            # Index repo packages by name and version
+            depends = p.get('depends', [])
+            conflicts = p.get('conflicts', [])
+            rows.append([pid, p['name'], p['version'], ranks[pid], p['size'], json.dumps(depends),
+                         json.dumps(conflicts)])
+            rdeps.extend([name, pid] for name in referenced_names(depends, conflicts))
+        c.executemany(insert_package, rows)
+        c.executemany(insert_rdepends, rdeps)
+        self.conn.commit()
+
+    def rerank(self, names):
+        c = self.c
+        c.execute("SELECT id, name, version FROM packages WHERE name IN %s", [tuple(names)])
+        ranks = rank_versions((r['id'], r['name'], r['version']) for r in c.fetchall())
+        c.executemany("UPDATE packages SET version_rank = %s WHERE id = %s",
+                      [[rank, pid] for pid, rank in ranks.items()])
+
+    def apply_delta(self, delta):
+        c = self.c
+        self._store = None
+        self.resolved.clear()
+        # Names whose set of available versions changed, anything mentioning them has to be resolved again
+        changed_names = set()
+
+        for entry in delta['removed']:
+            name, version = entry.split("=")
+            c.execute("SELECT id FROM packages WHERE name = %s AND version = %s", [name, version])
+            for res in c.fetchall():
+                c.execute("DELETE FROM conflicts WHERE package_id = %s OR conflict_package_id = %s",
+                          [res['id'], res['id']])
+                c.execute("DELETE FROM rdepends WHERE package_id = %s", [res['id']])
+                c.execute("DELETE FROM packages WHERE id = %s", [res['id']])
+            changed_names.add(name)
+
+        for p in delta['replaced']:
+            depends = p.get('depends', [])
+            conflicts = p.get('conflicts', [])
+            c.execute("SELECT id FROM packages WHERE name = %s AND version = %s", [p['name'], p['version']])
+            res = c.fetchall()
+            if not res:
+                delta['added'].append(p)
+            for r in res:
+                # Same name and version, so rows pointing at this package from elsewhere are still valid
+                c.execute("DELETE FROM conflicts WHERE package_id = %s", [r['id']])
+                c.execute("DELETE FROM rdepends WHERE package_id = %s", [r['id']])
+                c.execute("UPDATE packages SET weight = %s, depends = %s, conflicts = %s, conflicts_done = 0 "
+                          "WHERE id = %s", [p['size'], json.dumps(depends), json.dumps(conflicts), r['id']])
+                c.executemany(insert_rdepends, [[name, r['id']] for name in referenced_names(depends, conflicts)])
+
+        for p in delta['added']:
+            depends = p.get('depends', [])
+            conflicts = p.get('conflicts', [])
+            c.execute(insert_package, [None, p['name'], p['version'], 0, p['size'], json.dumps(depends),
+                                       json.dumps(conflicts)])
+            pid = c.lastrowid
+            c.executemany(insert_rdepends, [[name, pid] for name in referenced_names(depends, conflicts)])
+            changed_names.add(p['name'])
+
+        if changed_names:
+            c.execute("SELECT DISTINCT package_id FROM rdepends WHERE name IN %s", [tuple(changed_names)])
+            stale = tuple(r['package_id'] for r in c.fetchall())
+            if stale:
+                c.execute("DELETE FROM conflicts WHERE package_id IN %s", [stale])
+                c.execute("UPDATE packages SET conflicts_done = 0 WHERE id IN %s", [stale])
+            self.rerank(changed_names)
+        self.conn.commit()
+
+    @property
+    def store(self):
+        # The whole index in memory, read in one pass the first time a solve needs more than a few rows of it
+        if self._store is None:
+            with self.metrics.phase('index'):
+                c = self.cursor(pymysql.cursors.SSCursor)
+                c.execute("SELECT id, name, version, version_rank, weight, depends, conflicts, conflicts_done "
+                          "FROM packages ORDER BY id")
+                self._store = PackageStore.load(c)
+                c.close()
+            self.metrics.set('packages', len(self._store))
+        return self._store
+
+    def packages_named(self, name):
+        return self.store.views_named(name)
+
+    def resolve(self, version_string):
+        # Packages matching a dependency or conflict string, by id
+        candidates = self.resolved.get(version_string)
+        if candidates is None:
+            matcher = compile_vstring(version_string)
+            candidates = dict((r['id'], r) for r in self.packages_named(matcher.name) if matcher.matches(r['version']))
+            self.resolved.put(version_string, candidates)
+        return candidates
+
+    def add_conflicts(self, pid):
+        c = self.c
+        store = self.store
+        row = store.row(pid)
+        if store.conflicts_done[row]:
+            # Conflict rows persist with the index and are only reset when a delta touches a name they mention
+            return
+        c.executemany("INSERT IGNORE INTO conflicts(package_id, conflict_package_id) VALUES (%s, %s)",
+                      [[pid, con] for conflict in store.conflicts(row) for con in self.resolve(conflict)])
+        c.execute("UPDATE packages SET conflicts_done = 1 WHERE id = %s", [pid])
+        store.conflicts_done[row] = 1
+        self.conn.commit()
+
+    def find_packages(self, names):
+        # Every version of the given names, grouped by name
+        packages = {}
+        if names:
+            self.c.execute("SELECT id, name, version, version_rank, weight, depends, conflicts FROM packages "
+                           "WHERE name IN %s", [tuple(names)])
+            for r in self.c.fetchall():
+                r['depends'] = json.loads(r['depends'])
+                r['conflicts'] = json.loads(r['conflicts'])
+                packages.setdefault(r['name'], []).append(r)
+        return packages
+
+    def lock_packages(self, installed):
+        if not installed:
+            return {}
+        self.c.execute("SELECT name, version, depends, conflicts FROM packages WHERE (name, version) IN %s",
+                       [tuple(tuple(package.split("=")) for package in installed)])
+        return dict((r['name'] + "=" + r['version'], {'depends': json.loads(r['depends']),
+                                                       'conflicts': json.loads(r['conflicts'])})
+                    for r in self.c.fetchall())
@@ -1,511 +1,179 @@
 import argparse
 import json
+import os
 import sys
-from operator import *
-import networkx as nx
-import pymysql.cursors
-from packaging import version as vparser
-from z3 import Solver, Bool, Not, Or, And, unsat, unknown, Z3Exception
 
-no_sql_notes = "SET sql_notes = 0"
-if sys.platform == "darwin":
-    cdbc = pymysql.connect(host='localhost', user='root', password='')
-else:
-    cdbc = pymysql.connect(unix_socket='/var/run/mysqld/mysqld.sock', user='root', password='')
-cdbc.cursor().execute(no_sql_notes)
-cdbc.cursor().execute("CREATE DATABASE IF NOT EXISTS depsolve")
-cdbc.commit()
-
-parser = argparse.ArgumentParser(description='Solve dependencies')
-parser.add_argument('repo', metavar='r', type=str)
-parser.add_argument('initial', metavar='i', type=str)
-parser.add_argument('constraints', metavar='c', type=str)
-
-args = parser.parse_args()
-
-with open(args.repo, 'r') as repo_file:
-    repository = json.load(repo_file)
-
-with open(args.initial, 'r') as initial_file:
-    initial = json.load(initial_file)
-
-with open(args.constraints, 'r') as constraints_file:
-    constraints = json.load(constraints_file)
-
-if len(constraints) == 0:
-    print(json.dumps([]))
-    exit(0)
-
-
-def make_conn():
-    if sys.platform == "darwin":
-        # Connect to the database
-        conn = pymysql.connect(host='localhost',
-                               user='root',
-                               password='',
-                               db='depsolve',
-                               charset='utf8mb4',
-                               cursorclass=pymysql.cursors.DictCursor)
+if __name__ == '__main__' and not __package__:
+    # Run as solver/solve.py rather than python -m solver.solve: Python has put this directory on sys.path, which would
+    # make every module in here importable under its bare name, so import through the package from its parent instead
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __package__ = 'solver'
+
+from .fastpath import satisfied
+from .reader import load_json, snapshot_chain
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Solve dependencies')
+    parser.add_argument('repo', metavar='r', type=str)
+    parser.add_argument('initial', metavar='i', type=str, nargs='?')
+    parser.add_argument('constraints', metavar='c', type=str, nargs='?')
+    parser.add_argument('--delta', action='append', default=[],
+                        help='Repository delta (added/removed/replaced packages) applied on top of repo, may be repeated')
+    parser.add_argument('--lock', metavar='PATH', type=str,
+                        help='Lockfile holding the last solved state, reused when it is still valid for the repository')
+    parser.add_argument('--cache', metavar='PATH', type=str, help='SQLite file to cache solutions in')
+    parser.add_argument('--cache-size', metavar='N', type=int, default=10000,
+                        help='Number of solutions kept in the cache before the least recently used are evicted')
+    parser.add_argument('--orderings', action='store_true',
+                        help='Solve once per candidate ordering following one candidate per dependency, as before the '
+                             'optimising solve, and keep the cheapest plan')
+    parser.add_argument('--at-most-one', choices=['pairwise', 'sequential', 'atmost'], default='atmost',
+                        help='Encoding of names whose versions all conflict with each other (see bench/at_most_one.py)')
+    parser.add_argument('--metrics', metavar='PATH', type=str,
+                        help='Write wall and CPU time per phase and per strategy, counts and the strategy chosen as JSON')
+    parser.add_argument('--profile', choices=['cprofile', 'sample'],
+                        help='Profile the run with cProfile (pstats file) or a sampling thread (collapsed stacks)')
+    parser.add_argument('--profile-out', metavar='PATH', type=str,
+                        help='Where the profile goes (default profile.pstats or profile.folded)')
+    parser.add_argument('--profile-hz', metavar='N', type=int, default=100, help='Samples a second for --profile sample')
+    parser.add_argument('--memory', action='store_true',
+                        help='Add tracemalloc peaks and max RSS per phase and the top allocation sites of the worst '
+                             'phase to --metrics (slow)')
+    parser.add_argument('--sql-trace', action='store_true',
+                        help='Add the calls, total and p99 latency of every SQL statement per phase to --metrics and '
+                             'list statements issued once per row (N+1)')
+    parser.add_argument('--solver-log', metavar='PATH', type=str,
+                        help='Append the instance size and z3 statistics of each solve to PATH as a JSON line '
+                             '(rolled over to PATH.1 at 10 MB)')
+    parser.add_argument('--timeout', metavar='SECONDS', type=float, default=120,
+                        help='Give up with no solution when a z3 check runs longer than this, 0 for no limit')
+    parser.add_argument('--batch', metavar='PATH', type=str,
+                        help='Solve every request in a JSON lines file against one load of the repository')
+    parser.add_argument('--jobs', metavar='N', type=int, default=1, help='Number of batch requests solved at once')
+    return parser
+
+
+def make_validate_parser():
+    parser = argparse.ArgumentParser(prog='solve validate',
+                                     description='Check a plan against the repository and report its cost')
+    parser.add_argument('repo', metavar='r', type=str)
+    parser.add_argument('initial', metavar='i', type=str)
+    parser.add_argument('constraints', metavar='c', type=str)
+    parser.add_argument('plan', metavar='p', type=str, help='JSON list of commands, - for standard input')
+    parser.add_argument('--delta', action='append', default=[],
+                        help='Repository delta (added/removed/replaced packages) applied on top of repo, may be repeated')
+    return parser
+
+
+def validate(argv):
+    args = make_validate_parser().parse_args(argv)
+    initial = load_json(args.initial)
+    constraints = load_json(args.constraints)
+    if args.plan == '-':
+        text = sys.stdin.read()
     else:
-        # Connect to the database
-        conn = pymysql.connect(unix_socket='/var/run/mysqld/mysqld.sock',
-                               user='root',
-                               password='',
-                               db='depsolve',
-                               charset='utf8mb4',
-                               cursorclass=pymysql.cursors.DictCursor)
-    return conn
-
-
-package_db = \
-    '''
-    CREATE TABLE packages (
-        id INTEGER PRIMARY KEY AUTO_INCREMENT,
-        name VARCHAR(255),
-        version VARCHAR(255),
-        weight INTEGER,
-        depends TEXT,
-        conflicts TEXT
-    );
-    '''
-
-conflicts_db = \
-    """
-    CREATE TABLE conflicts (
-        package_id INTEGER,
-        conflict_package_id INTEGER,
-        PRIMARY KEY (package_id, conflict_package_id),
-        FOREIGN KEY (package_id) REFERENCES packages(id),
-        FOREIGN KEY (conflict_package_id) REFERENCES packages(id)
-    );
-    """
-
-depends_db = \
-    """
-    CREATE TABLE depends (
-        package_id INTEGER,
-        depend_package_id INTEGER,
-        must_be_installed INTEGER,
-        opt_dep_group INTEGER,
-        PRIMARY KEY (package_id, depend_package_id),
-        FOREIGN KEY (package_id) REFERENCES packages(id),
-        FOREIGN KEY (depend_package_id) REFERENCES packages(id)
-    );
-    """
-
-state_db = \
-    """
-    CREATE TABLE state (
-        package_id INTEGER,
-        PRIMARY KEY (package_id), 
-        FOREIGN KEY (package_id) REFERENCES packages(id)
-    )
-    """
-
-unset_for_key_check = "SET foreign_key_checks = 0"
-set_for_key_check = "SET foreign_key_checks = 1"
-del_pkg = "DROP TABLE IF EXISTS packages, conflicts, depends, state"
-del_everything_except_pkg = "DROP TABLE IF EXISTS conflicts, depends, state"
-
-opt_dep_group = 0
-
-
-def parse_constraints(constraints, order_by):
-    installs = []
-    uninstalls = []
-    for constraint in constraints:
-        if constraint[0] == "+":
-            if "=" in constraint:
-                const = constraint[1:].split("=")
-                c.execute("SELECT id FROM packages WHERE name = %s AND version = %s", [const[0], const[1]])
-                id = c.fetchone()
-                installs.append(id['id'])
-            else:
-                c.execute("SELECT id FROM packages WHERE name = %s ORDER BY " + order_by, [constraint[1:]])
-                id = c.fetchone()
-                if id is not None:
-                    installs.append(id['id'])
-                else:
-                    c.execute("SELECT id FROM packages WHERE name = %s ORDER BY weight ASC", [constraint[1:]])
-                    id = c.fetchone()
-                    installs.append(id['id'])
-        else:
-            if "=" in constraint:
-                const = constraint[1:].split("=")
-                c.execute("SELECT id FROM packages WHERE name = %s AND version = %s", [const[0], const[1]])
-                id = c.fetchone()
-                uninstalls.append(id['id'])
-            else:
-                c.execute("SELECT id FROM packages WHERE name = %s ORDER BY " + order_by, [constraint[1:]])
-                id = c.fetchone()
-                if id is not None:
-                    uninstalls.append(id['id'])
-                else:
-                    c.execute("SELECT id FROM packages WHERE name = %s ORDER BY weight ASC", [constraint[1:]])
-                    id = c.fetchone()
-                    uninstalls.append(id['id'])
-
-    return installs, uninstalls
-
-
-def parse_vstring(version_string):
-    if ">=" in version_string:
-        return (version_string.split(">=")[0], version_string.split(">=")[1], ge)
-    elif "<=" in version_string:
-        return (version_string.split("<=")[0], version_string.split("<=")[1], le)
-    elif "=" in version_string:
-        return (version_string.split("=")[0], version_string.split("=")[1], eq)
-    elif "<" in version_string:
-        return (version_string.split("<")[0], version_string.split("<")[1], lt)
-    elif ">" in version_string:
-        return (version_string.split(">")[0], version_string.split(">")[1], gt)
+        with open(args.plan) as f:
+            text = f.read()
+    try:
+        commands = json.loads(text)
+    except ValueError:
+        commands = None
+    if not isinstance(commands, list):
+        error, cost = "not a list of commands: %r" % text.strip()[:80], 0
     else:
-        return version_string, None, None
-
-
-def add_deps(pid, order_by):
-    global opt_dep_group
-    c.execute("SELECT depends FROM packages WHERE id = %s", [pid])
-    depends = c.fetchone()
-    depends = json.loads(depends['depends'])
-    if len(depends) > 0:
-        for dlist in depends:
-            if len(dlist) == 1:
-                must_be_installed = 1
-            else:
-                must_be_installed = 0
-            for dep in dlist:
-                package_name, package_version, package_req = parse_vstring(dep)
-                if package_req is not None and package_version is not None:
-                    c.execute("SELECT id, version, weight FROM packages WHERE name = %s ORDER BY " + order_by,
-                              [package_name])
-                    packages = c.fetchall()
-                    if len(packages) != 0:
-                        add_deps_versions_to_db(must_be_installed, opt_dep_group, packages, pid, package_req, package_version)
-                    else:
-                        c.execute("SELECT id, version, weight FROM packages WHERE name = %s ORDER BY weight ASC",
-                                  [package_name])
-                        packages = c.fetchall()
-                        if len(packages) != 0:
-                            add_deps_versions_to_db(must_be_installed, opt_dep_group, packages, pid, package_req, package_version)
-                else:
-                    c.execute("SELECT id, version, weight FROM packages WHERE name = %s ORDER BY " + order_by,
-                              [package_name])
-                    packages = c.fetchall()
-                    if len(packages) != 0:
-                        # We didn't find ANY packages in the repo with this name! That mean
-                        # list(sorted(packages, key=lambda x: x['weight']))
-
-                        add_dep_to_db(must_be_installed, opt_dep_group, packages, pid)
-                    else:
-                        c.execute("SELECT id, version, weight FROM packages WHERE name = %s ORDER BY weight ASC",
-                                  [package_name])
-                        packages = c.fetchall()
-                        if len(packages) != 0:
-                            add_dep_to_db(must_be_installed, opt_dep_group, packages, pid)
-            opt_dep_group += 1
-    conn.commit()
-
-
-def add_deps_versions_to_db(must_be_installed, opt_dep_group, packages, pid, package_req, package_version):
-    packages_rightversion = filter(
-        lambda x: package_req(vparser.parse(x['version']), vparser.parse(package_version)),
-        packages)
-    l = list(packages_rightversion)
-    if len(l) > 0:
-        add_dep_to_db(must_be_installed, opt_dep_group, l, pid)
-
-
-def add_dep_to_db(must_be_installed, opt_dep_group, packages, pid):
-    depid = packages[0]['id']
+        from .repository import Repository
+        from .validate import validate_plan
+        error, cost = validate_plan(Repository.load(args.repo, args.delta), initial, constraints, commands)
+    print(json.dumps({'valid': error is None, 'cost': cost, 'error': error}))
+    sys.exit(0 if error is None else 1)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['validate']:
+        validate(argv[1:])
+        return
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.memory and not args.metrics:
+        parser.error("--memory needs --metrics to report to")
+    if args.sql_trace and not args.metrics:
+        parser.error("--sql-trace needs --metrics to report to")
+
+    metrics = None
+    if args.metrics:
+        from .metrics import Metrics
+        metrics = Metrics(memory=args.memory, sql=args.sql_trace)
     try:
-        c.execute(
-            "INSERT INTO depends(package_id, depend_package_id, must_be_installed, opt_dep_group) VALUES (%s, %s, %s, %s)",
-            [pid, depid, must_be_installed, opt_dep_group])
-    except pymysql.IntegrityError:
-        pass
-
-
-def add_conflicts(pid):
-    c.execute("SELECT conflicts FROM packages WHERE id = %s", [pid])
-    conflicts = c.fetchone()
-    conflicts = json.loads(conflicts['conflicts'])
-    if len(conflicts) > 0:
-        for conflict in conflicts:
-            package_name, package_version, package_req = parse_vstring(conflict)
-            if package_req is not None and package_version is not None:
-                c.execute("SELECT id, version FROM packages WHERE name = %s", [package_name])
-                cons = c.fetchall()
-                for con in cons:
-                    if package_req(vparser.parse(con['version']), vparser.parse(package_version)):
-                        try:
-                            c.execute("INSERT INTO conflicts(package_id, conflict_package_id) VALUES (%s, %s)",
-                                      [pid, con['id']])
-                        except pymysql.IntegrityError:
-                            pass
-            else:
-                c.execute("SELECT id FROM packages WHERE name = %s", [package_name])
-                cons = c.fetchall()
-                for con in cons:
-                    try:
-                        c.execute("INSERT INTO conflicts(package_id, conflict_package_id) VALUES (%s, %s)",
-                                  [pid, con['id']])
-                    except pymysql.IntegrityError:
-                        pass
-    conn.commit()
-
-
-def add_dep_to_installs(package_id, order_by):
-    if package_id not in seen:
-        seen.append(package_id)
-        add_deps(package_id, order_by)
-        add_conflicts(package_id)
-        check_in = "AND package_id NOT IN (" + ", ".join(map(str, uninstalls)) + ")" if len(uninstalls) > 0 else ""
-        # check_in_2 = "AND depend_package_id NOT IN (" + ", ".join(map(str, installs)) + ")" if len(installs) > 0 else ""
-        check_in_2 = ""
-        c.execute(
-            "SELECT depend_package_id, opt_dep_group, weight, must_be_installed, weight FROM depends, packages WHERE package_id = %s AND packages.id = %s " + check_in + check_in_2 + " ORDER BY weight ASC",
-            [package_id, package_id])
-        tmp = c.fetchall()  # Only get ID
-        dependencies = []
-        if len(tmp) != 0:
-            for d in tmp:
-                add_deps(d['depend_package_id'], order_by)
-                add_conflicts(d['depend_package_id'])
-                add_conflict_to_uninstalls(d['depend_package_id'], order_by)
-                if d['depend_package_id'] not in installs:
-                    add_dep_to_installs(d['depend_package_id'], order_by)
-                ii, _ = parse_constraints(constraints, order_by)
-                # if d['depend_package_id'] not in ii:
-                G.add_node(d['depend_package_id'], opt_dep_group=d['opt_dep_group'], required=0,
-                           weight=d['weight'], conflict=False)
-                G.add_edge(package_id, d['depend_package_id'])
-                if d['depend_package_id'] not in dependencies:
-                    dependencies.append(d['depend_package_id'])
+        if args.profile:
+            from .profiling import profiled
+            with profiled(args.profile, args.profile_out, args.profile_hz):
+                run(parser, args, metrics)
         else:
-            add_conflict_to_uninstalls(package_id, order_by)
-            ii, _ = parse_constraints(constraints, order_by)
-            if package_id not in ii:
-                G.add_node(package_id, required=0, opt_dep_group=-1, conflict=False)
-            installs_no_deps.append(package_id)
-        installs.extend(dependencies)
-
-
-def add_conflict_to_uninstalls(package_id, order_by):
-    add_conflicts(package_id)
-    c.execute("SELECT conflict_package_id FROM conflicts WHERE package_id = %s", [package_id])
-    tmp = c.fetchall()
-    conflicts = []
-    for con in tmp:
-        ii, _ = parse_constraints(constraints, order_by)
-        if con['conflict_package_id'] not in ii:
-            G.add_node(con['conflict_package_id'], conflict=True)
-            all_conflicts.append(con['conflict_package_id'])
-        G.add_edge(package_id, con['conflict_package_id'])
-        if con['conflict_package_id'] not in conflicts:
-            conflicts.append(con['conflict_package_id'])
-    uninstalls.extend(conflicts)
-    map(lambda x: add_conflict_to_uninstalls(x, order_by), conflicts)
-
-
-conn = make_conn()
-
-c = conn.cursor()
-c.execute(no_sql_notes)
-c.execute(unset_for_key_check)
-c.execute(del_pkg)
-c.execute(set_for_key_check)
-c.execute(package_db)
-
-conn.commit()
-
-for p in repository:
-    # Index repo packages by name and version
-    c.execute("INSERT INTO packages(name, version, weight, depends, conflicts) VALUES (%s, %s, %s, %s, %s)",
-              [p['name'], p['version'], p['size'], json.dumps(p['depends']) if 'depends' in p.keys() else "[]",
-               json.dumps(p['conflicts']) if 'conflicts' in p.keys() else "[]"])
-
-conn.commit()
-
-sols = []
-costs = []
-order_bys = ['weight ASC', 'weight DESC', 'version ASC', 'version DESC', 'id DESC', 'weight ASC LIMIT 1,1', 'weight ASC LIMIT 2,1', 'weight ASC LIMIT 3,1', 'weight ASC LIMIT 4,1']
-
-for order in order_bys:
-    c.execute(conflicts_db)
-    c.execute(depends_db)
-    c.execute(state_db)
-    conn.commit()
-    c.execute("SELECT id, name FROM packages")
-    ps = c.fetchall()
-    # print(ps)
-
-    G = nx.DiGraph()
-
-    installs, uninstalls = parse_constraints(constraints, order)
-    initial_installs = installs
-    initial_uninstalls = uninstalls
-    installs_no_deps = []
-    install_order = []
-    install_order_ids = []
-    state = []
-    all_conflicts = []
-    seen = []
-
-    # Setup the state
-    for i in initial:
-        if "=" in i:
-            name, version = i.split("=")
-            c.execute("SELECT id FROM packages WHERE name = %s and version = %s", [name, version])
-            res = c.fetchone()
-            c.execute("INSERT INTO state(package_id) VALUES(%s)", [res['id']])
-            state.append(res['id'])
-        else:
-            c.execute("SELECT id, weight FROM packages WHERE name = %s ORDER BY " + order, [i])
-            ps = c.fetchall()
-            pid = ps[0]['id']
-            c.execute("INSERT INTO state(package_id) VALUES(%s)", [pid])
-            state.append(pid)
-
-    # Uninstalls from constraints
-    for n in set(uninstalls):
-        c.execute("SELECT name, version FROM packages, state WHERE id = %s AND package_id = %s", [n, n])
-        res = c.fetchone()
-        if res:
-            install_order.append("-" + res['name'] + "=" + res['version'])
-            install_order_ids.append(n)
-
-    conn.commit()
-
-    # Do everything basically
-    ii, _ = parse_constraints(constraints, order)
-    for i in ii:
-        # print("Install: " + str(i))
-        G.add_node(i, required=1, opt_dep_group=-1, conflict=False)
-        add_dep_to_installs(i, order)
-
-    solver = Solver()
-
-    var_mapping = {}
-    node_groups = []
-    trues = []
-    ands = []
-
-    # Pseudocode
-
-    # Go through graph in reverse order
-    # Get all the direct descendants of a node
-    # These must be conflicts or dependencies
-    # So And([list of direct descendants])
-    # Inside the And we also may have Or, which would be the optional dependency groups
-    # Then get the direct descendents of these nodes etc. etc.
-    # Eventually we will have translated the whole graph structure to a SAT problem, can solve this and get what we need
-    # to install
-
-    cycles = nx.recursive_simple_cycles(G)
-    for cycle in cycles:
-        G.remove_nodes_from(cycle[1:])
-
-    for n in G.nodes(data=True):
-        direct_descendants = G[n[0]].keys()
-        nodes = G.nodes(data=True)
-        node_descendant = []
-        var_groups = {}
-        for descendant in direct_descendants:
-            if 'conflict' in nodes[descendant].keys() and nodes[descendant]['conflict'] is True:
-                v = Bool(descendant)
-                node_descendant.append(Not(v))
-                var_mapping[descendant] = v
-            elif 'required' in nodes[descendant].keys() and nodes[descendant]['required'] == 1:
-                node_descendant.append(True)
-                trues.append(descendant)
-            else:
-                # print("got here")
-                if nodes[descendant]['opt_dep_group'] in var_groups.keys():
-                    v = Bool(descendant)
-                    var_groups[nodes[descendant]['opt_dep_group']].append(v)
-                    var_mapping[descendant] = v
-                else:
-                    var_groups[nodes[descendant]['opt_dep_group']] = []
-                    v = Bool(descendant)
-                    var_groups[nodes[descendant]['opt_dep_group']].append(v)
-                    var_mapping[descendant] = v
-
-        ors = []
-        for var_group in var_groups:
-            ors.append(Or(var_groups[var_group]))
-        if ors:
-            node_descendant.append(And(ors))
-        if node_descendant:
-            node_groups.append(And(node_descendant))
-
-    solver.add(And(node_groups))
-
-    # print(all_conflicts)
-
-    # nx.draw(G, with_labels=True)
-    # plt.show()
-
-    # print(solver)
-
-    r = solver.check()
-
-    if r == unsat:
-        print("no solution")
-        exit(0)
-
-    m = solver.model()
-    # print(m)
-
-    packages_to_install = []
-    packages_to_uninstall = []
-
-    packages_to_install.extend(trues)
-
-    G_copy = G.copy()
-
-    c.execute("SELECT package_id FROM state")
-    res = c.fetchall()
-    state_ids = list(map(lambda x: x['package_id'], res))
-
-    for node in G_copy.nodes(data=True):
-        try:
-            if node[0] not in trues and not m[var_mapping[node[0]]] and not node[0] in state_ids:
-                G.remove_node(node[0])
-        except KeyError:
-            pass
-
-    # nx.draw(G, with_labels=True)
-    # plt.show()
+            run(parser, args, metrics)
+    finally:
+        if metrics is not None:
+            metrics.write(args.metrics)
+
+
+def run(parser, args, metrics):
+    if args.batch:
+        from .batch import run_batch
+        from .dependency_solver import SolveOptions, order_bys
+        from .repository import Repository
+        run_batch(Repository.load(args.repo, args.delta, metrics=metrics), args.batch, args.jobs,
+                  options=SolveOptions(order_bys=order_bys if args.orderings else None,
+                                       at_most_one=args.at_most_one, solver_log=args.solver_log,
+                                       timeout=args.timeout))
+        return
+    if args.initial is None or args.constraints is None:
+        parser.error("initial and constraints are required unless --batch is given")
+
+    initial = load_json(args.initial)
+    constraints = load_json(args.constraints)
+
+    if len(constraints) == 0 or satisfied(initial, constraints):
+        if metrics is not None:
+            metrics.set('strategy', 'satisfied')
+        print(json.dumps([]))
+        return
+
+    cache = None
+    # The lock is read and rewritten on every run and can give a plan a full solve wouldn't, so it bypasses the cache
+    if args.cache and not args.lock:
+        from .cache import ResultCache, request_key
+        cache = ResultCache(args.cache, args.cache_size)
+        snapshots = snapshot_chain(args.repo, args.delta, cache.file_hash)
+        cache_key = request_key(snapshots[-1], initial, constraints, 'orderings' if args.orderings else 'full')
+        cached_output = cache.get(cache_key)
+        cache.report(cached_output is not None)
+        if cached_output is not None:
+            if metrics is not None:
+                metrics.set('strategy', 'cache')
+            print(cached_output)
+            return
+    else:
+        snapshots = snapshot_chain(args.repo, args.delta)
 
-    cost = 0
+    # Only now is the package index needed, so the database driver and the solver aren't imported any earlier
+    from .dependency_solver import DependencySolver, SolveOptions, order_bys
+    from .repository import Repository
 
-    for n in nx.algorithms.dag.topological_sort(G.reverse()):
-        if n not in all_conflicts and n not in install_order_ids and n not in state_ids:
-            c.execute("SELECT name, version, weight FROM packages WHERE id = %s", [n])
-            res = c.fetchone()
-            install_order.append("+" + res['name'] + "=" + res['version'])
-            install_order_ids.append(n)
-            cost += res['weight']
-        elif n in state_ids or n in install_order_ids:
-            # Only uninstall if its in the state, or it's already been installed
-            c.execute("SELECT name, version FROM packages WHERE id = %s", [n])
-            res = c.fetchone()
-            install_order.append("-" + res['name'] + "=" + res['version'])
-            install_order_ids.append(n)
-            cost += 10 ** 6
+    repo = Repository.load(args.repo, args.delta, snapshots, metrics=metrics)
+    options = SolveOptions(lock=args.lock, order_bys=order_bys if args.orderings else None,
+                           at_most_one=args.at_most_one, solver_log=args.solver_log, timeout=args.timeout)
+    plan = DependencySolver(repo).solve(initial, constraints, options)
 
-    sols.append(json.dumps(install_order))
-    costs.append(cost)
-    c.execute(unset_for_key_check)
-    c.execute(del_everything_except_pkg)
-    c.execute(set_for_key_check)
-    conn.commit()
+    output = plan.to_json()
+    print(output)
+    if plan.strategy == 'timeout':
+        # Not an answer, just z3 giving up, so it isn't cached
+        print("z3 gave up after %gs" % args.timeout, file=sys.stderr)
+    elif cache is not None:
+        cache.put(cache_key, output)
 
-smallest_index = costs.index(min(costs))
-print(sols[smallest_index])
 
-c.execute(unset_for_key_check)
-c.execute(del_pkg)
-c.execute(set_for_key_check)
-conn.commit()
+if __name__ == '__main__':
+    main()
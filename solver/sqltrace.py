@@ -0,0 +1,91 @@
+import re
+import time
+from array import array
+
+# A statement issued this many times one row at a time within one phase is reported as an N+1 pattern
+n_plus_one_calls = 50
+
+literals = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|\b\d+\b|%s")
+spaces = re.compile(r"\s+")
+
+
+def normalise_statement(sql):
+    # The statement with its placeholders and literals replaced by ? and its whitespace collapsed, so calls that only
+    # differ in the values they were given count as one statement
+    return spaces.sub(" ", literals.sub("?", sql)).strip()
+
+
+def percentile(latencies, q):
+    # Nearest rank
+    ordered = sorted(latencies)
+    return ordered[max(0, -(-len(ordered) * q // 100) - 1)]
+
+
+class QueryTrace:
+    # Calls and latencies of every statement, per normalised statement and phase. The phase is the innermost one
+    # running in metrics when the statement was issued, "other" outside of any.
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.statements = {}
+        self.normalised = {}
+
+    def record(self, sql, seconds, many=False):
+        statement = self.normalised.get(sql)
+        if statement is None:
+            statement = self.normalised[sql] = normalise_statement(sql)
+        phase = self.metrics.stack[-1] if self.metrics.stack else 'other'
+        entry = self.statements.get((phase, statement))
+        if entry is None:
+            entry = self.statements[phase, statement] = {'calls': 0, 'many': 0, 'latencies': array('d')}
+        entry['calls'] += 1
+        if many:
+            entry['many'] += 1
+        entry['latencies'].append(seconds)
+
+    def report(self):
+        phases = {}
+        n_plus_one = []
+        queries = 0
+        seconds = 0.0
+        for (phase, statement), entry in sorted(self.statements.items()):
+            latencies = entry['latencies']
+            total = sum(latencies)
+            queries += entry['calls']
+            seconds += total
+            phases.setdefault(phase, {})[statement] = {
+                'calls': entry['calls'], 'executemany': entry['many'], 'seconds': total,
+                'p99': percentile(latencies, 99), 'max': max(latencies)}
+            if entry['calls'] - entry['many'] >= n_plus_one_calls:
+                n_plus_one.append({'phase': phase, 'statement': statement, 'calls': entry['calls'] - entry['many']})
+        n_plus_one.sort(key=lambda entry: -entry['calls'])
+        return {'queries': queries, 'seconds': seconds, 'phases': phases, 'n_plus_one': n_plus_one}
+
+
+class TracedCursor:
+    # Wraps a DB-API cursor and records every execute and executemany in trace. For an unbuffered cursor the time
+    # is only up to the first row, reading the rest happens in fetch calls that aren't timed.
+
+    def __init__(self, cursor, trace):
+        self.cursor = cursor
+        self.trace = trace
+
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return self.cursor.execute(sql, *args)
+        finally:
+            self.trace.record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, args):
+        start = time.perf_counter()
+        try:
+            return self.cursor.executemany(sql, args)
+        finally:
+            self.trace.record(sql, time.perf_counter() - start, many=True)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
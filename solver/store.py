@@ -0,0 +1,148 @@
+import json
+import sys
+from array import array
+
+
+class PackageView:
+    # Per package access into a PackageStore. Also answers view['name'] etc. so it can stand in for a row dict.
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    @property
+    def id(self):
+        return self.store.ids[self.row]
+
+    @property
+    def name(self):
+        return self.store.names[self.store.name_ids[self.row]]
+
+    @property
+    def version(self):
+        return self.store.versions[self.row]
+
+    @property
+    def version_rank(self):
+        return self.store.version_ranks[self.row]
+
+    @property
+    def weight(self):
+        return self.store.weights[self.row]
+
+    @property
+    def depends(self):
+        return self.store.depends(self.row)
+
+    @property
+    def conflicts(self):
+        return self.store.conflicts(self.row)
+
+
+class PackageStore:
+    # Packages held column-wise: one array per field, indexed by row. Names and dependency/conflict strings are
+    # interned to integer ids. A package's depends are the groups group_offsets[dep_offsets[row]:dep_offsets[row + 1]]
+    # and each group g is the strings dep_strings[group_offsets[g]:group_offsets[g + 1]]; conflicts are
+    # conflict_strings[conflict_offsets[row]:conflict_offsets[row + 1]].
+
+    def __init__(self):
+        self.ids = array('i')
+        self.name_ids = array('i')
+        self.versions = []
+        self.version_ranks = array('i')
+        self.weights = array('q')
+        self.conflicts_done = bytearray()
+
+        self.dep_offsets = array('i', [0])
+        self.group_offsets = array('i', [0])
+        self.dep_strings = array('i')
+        self.conflict_offsets = array('i', [0])
+        self.conflict_strings = array('i')
+
+        self.names = []
+        self.name_index = {}
+        self.name_rows = []
+        self.strings = []
+        self.string_index = {}
+        # Package id -> row, -1 for ids that aren't in the store
+        self.row_of = array('i')
+
+    @classmethod
+    def load(cls, rows):
+        # rows are (id, name, version, version_rank, weight, depends json, conflicts json, conflicts_done) tuples
+        store = cls()
+        for pid, name, version, version_rank, weight, depends, conflicts, conflicts_done in rows:
+            store.add(pid, name, version, version_rank, weight, json.loads(depends), json.loads(conflicts),
+                      conflicts_done)
+        return store
+
+    def intern_name(self, name):
+        name_id = self.name_index.get(name)
+        if name_id is None:
+            name_id = self.name_index[sys.intern(name)] = len(self.names)
+            self.names.append(name)
+            self.name_rows.append(array('i'))
+        return name_id
+
+    def intern_string(self, string):
+        string_id = self.string_index.get(string)
+        if string_id is None:
+            string_id = self.string_index[sys.intern(string)] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def add(self, pid, name, version, version_rank, weight, depends, conflicts, conflicts_done=0):
+        row = len(self.ids)
+        name_id = self.intern_name(name)
+        self.ids.append(pid)
+        self.name_ids.append(name_id)
+        self.versions.append(sys.intern(version))
+        self.version_ranks.append(version_rank)
+        self.weights.append(weight)
+        self.conflicts_done.append(1 if conflicts_done else 0)
+        self.name_rows[name_id].append(row)
+
+        for dlist in depends:
+            self.dep_strings.extend(self.intern_string(dep) for dep in dlist)
+            self.group_offsets.append(len(self.dep_strings))
+        self.dep_offsets.append(len(self.group_offsets) - 1)
+        self.conflict_strings.extend(self.intern_string(conflict) for conflict in conflicts)
+        self.conflict_offsets.append(len(self.conflict_strings))
+
+        if pid >= len(self.row_of):
+            self.row_of.extend([-1] * (pid + 1 - len(self.row_of)))
+        self.row_of[pid] = row
+        return row
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, pid):
+        row = self.row_of[pid] if 0 <= pid < len(self.row_of) else -1
+        if row < 0:
+            raise KeyError(pid)
+        return row
+
+    def view(self, pid):
+        return PackageView(self, self.row(pid))
+
+    def views_named(self, name):
+        name_id = self.name_index.get(name)
+        if name_id is None:
+            return []
+        return [PackageView(self, row) for row in self.name_rows[name_id]]
+
+    def depends(self, row):
+        strings = self.strings
+        groups = []
+        for g in range(self.dep_offsets[row], self.dep_offsets[row + 1]):
+            groups.append([strings[s] for s in self.dep_strings[self.group_offsets[g]:self.group_offsets[g + 1]]])
+        return groups
+
+    def conflicts(self, row):
+        strings = self.strings
+        return [strings[s] for s in self.conflict_strings[self.conflict_offsets[row]:self.conflict_offsets[row + 1]]]
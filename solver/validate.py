@@ -0,0 +1,149 @@
+from .dependency_solver import uninstall_cost
+
+
+def package_id(repo, package):
+    # Id of the name=version package in the repository, None if there is no such package
+    name, _, version = package.partition("=")
+    for view in repo.packages_named(name):
+        if view['version'] == version:
+            return view['id']
+    return None
+
+
+class Replay:
+    # The installed packages of a state with counters that make checking it cheap after each change: for every
+    # installed package and depends group the number of installed candidates, and the depends groups and conflicting
+    # pairs currently broken. Installing or removing a package only touches its own depends and conflicts and the
+    # groups and conflicts that mention it.
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.store = repo.store
+        self.installed = set()
+        # pid -> installed candidates per depends group
+        self.counts = {}
+        # candidate -> (pid, group) of installed packages it is a candidate of
+        self.dep_watchers = {}
+        # candidate -> installed packages conflicting with it
+        self.conflict_watchers = {}
+        self.broken = set()
+        self.clashes = set()
+        self.groups = {}
+        self.conflicts = {}
+
+    def candidates(self, pid):
+        # Deduplicated candidates of each depends group and the packages conflicted with, resolved once per package
+        groups = self.groups.get(pid)
+        if groups is None:
+            row = self.store.row(pid)
+            groups = self.groups[pid] = [list(dict.fromkeys(cid for dep in dlist for cid in self.repo.resolve(dep)))
+                                         for dlist in self.store.depends(row)]
+            self.conflicts[pid] = list(dict.fromkeys(cid for conflict in self.store.conflicts(row)
+                                                     for cid in self.repo.resolve(conflict) if cid != pid))
+        return groups, self.conflicts[pid]
+
+    def install(self, pid):
+        groups, conflicts = self.candidates(pid)
+        installed = self.installed
+        counts = []
+        for g, group in enumerate(groups):
+            n = 0
+            for cid in group:
+                self.dep_watchers.setdefault(cid, set()).add((pid, g))
+                # A package counts for its own depends
+                if cid in installed or cid == pid:
+                    n += 1
+            counts.append(n)
+            if n == 0:
+                self.broken.add((pid, g))
+        self.counts[pid] = counts
+        for cid in conflicts:
+            self.conflict_watchers.setdefault(cid, set()).add(pid)
+            if cid in installed:
+                self.clashes.add((pid, cid))
+
+        installed.add(pid)
+        for other, g in self.dep_watchers.get(pid, ()):
+            if other != pid:
+                self.counts[other][g] += 1
+                self.broken.discard((other, g))
+        for other in self.conflict_watchers.get(pid, ()):
+            self.clashes.add((other, pid))
+
+    def uninstall(self, pid):
+        groups, conflicts = self.candidates(pid)
+        self.installed.discard(pid)
+        for g, group in enumerate(groups):
+            for cid in group:
+                self.dep_watchers[cid].discard((pid, g))
+            self.broken.discard((pid, g))
+        del self.counts[pid]
+        for cid in conflicts:
+            self.conflict_watchers[cid].discard(pid)
+            self.clashes.discard((pid, cid))
+
+        for other, g in self.dep_watchers.get(pid, ()):
+            self.counts[other][g] -= 1
+            if self.counts[other][g] == 0:
+                self.broken.add((other, g))
+        for other in self.conflict_watchers.get(pid, ()):
+            self.clashes.discard((other, pid))
+
+    def describe(self, pid):
+        view = self.store.view(pid)
+        return view.name + "=" + view.version
+
+    def problem(self):
+        # What is wrong with the current state, None if nothing is
+        if self.broken:
+            pid, g = min(self.broken)
+            return "%s depends on one of %s" % (self.describe(pid),
+                                                ", ".join(self.store.depends(self.store.row(pid))[g]))
+        if self.clashes:
+            pid, cid = min(self.clashes)
+            return "%s conflicts with %s" % (self.describe(pid), self.describe(cid))
+        return None
+
+
+def validate_plan(repo, initial, constraints, commands):
+    # Replays commands over the initial state and returns (error, cost), error being None for a valid plan: every
+    # command applies, the state after each one has its depends met and no conflicts, and the final state meets the
+    # constraints. The initial state itself isn't checked. The cost is that of the whole plan even when a state on
+    # the way is broken, up to a command that can't be applied. Each step costs the depends and conflicts of the package
+    # changed and of those that mention it, rather than a check of the whole state.
+    replay = Replay(repo)
+    for package in initial:
+        pid = package_id(repo, package)
+        if pid is None:
+            return "initial package %s is not in the repository" % package, 0
+        if pid not in replay.installed:
+            replay.install(pid)
+
+    cost = 0
+    error = None
+    for step, command in enumerate(commands, 1):
+        pid = package_id(repo, command[1:]) if command[:1] in ("+", "-") else None
+        if pid is None:
+            return "step %d (%s): no such package" % (step, command), cost
+        if command[0] == "+":
+            if pid in replay.installed:
+                return "step %d (%s): already installed" % (step, command), cost
+            replay.install(pid)
+            cost += repo.store.weights[repo.store.row(pid)]
+        else:
+            if pid not in replay.installed:
+                return "step %d (%s): not installed" % (step, command), cost
+            replay.uninstall(pid)
+            cost += uninstall_cost
+        if error is None:
+            problem = replay.problem()
+            if problem is not None:
+                error = "step %d (%s): %s" % (step, command, problem)
+    if error is not None:
+        return error, cost
+
+    for constraint in constraints:
+        found = any(cid in replay.installed for cid in repo.resolve(constraint[1:]))
+        if (constraint[0] == "+") != found:
+            return "final state doesn't meet %s" % constraint, cost
+    return None, cost